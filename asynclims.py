@@ -0,0 +1,235 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Non-blocking LIMS interface.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+__all__ = ['Lab', 'Researcher', 'Project', 'Sample',
+           'Containertype', 'Container', 'Processtype', 'Process',
+           'Artifact', 'File', 'Lims', 'AsyncLims']
+
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+
+from .lims import *
+
+
+class AsyncLims(Lims):
+    """LIMS interface where each call is done in a thread of a bounded pool,
+    so that the caller, for instance an event loop, is never blocked.
+    The a* methods return an AsyncResult immediately; its method get()
+    waits for and returns the value, or raises the exception, of the
+    corresponding blocking method. A callback may be given to be called
+    with the value when it is ready. The aiter_* methods yield a result
+    for each page of a list, and one with the value None at its end.
+
+    The entity classes and the instance cache are shared with Lims,
+    and all the blocking methods of Lims remain available.
+    """
+
+    def __init__(self, baseuri, username, password, concurrency=100, **kwargs):
+        """concurrency: Max number of calls in progress at the same time;
+                        further calls are queued. Also the default max
+                        number of persistent connections to the server.
+        The other arguments are as for Lims.
+        """
+        kwargs.setdefault('pool_size', concurrency)
+        super(AsyncLims, self).__init__(baseuri, username, password, **kwargs)
+        self.concurrency = concurrency
+        self._async_pool = None
+
+    def close(self):
+        "Stop the threads for the calls, and close the connections."
+        with self._pool_lock:
+            if self._async_pool is not None:
+                self._async_pool.terminate()
+                self._async_pool = None
+        super(AsyncLims, self).close()
+
+    def submit(self, func, *args, **kwargs):
+        """Call the function with the arguments in a thread of the pool.
+        The keyword argument 'callback', if given, is called with the value
+        of the function when it is ready. Return an AsyncResult.
+        """
+        callback = kwargs.pop('callback', None)
+        with self._pool_lock:
+            if self._async_pool is None:
+                # Separate from the worker pool used within the calls,
+                # so that a call never waits for a thread held by another.
+                self._async_pool = ThreadPool(self.concurrency)
+            pool = self._async_pool
+        return pool.apply_async(func, args, kwargs, callback=callback)
+
+    def aget(self, uri, params=dict(), callback=None):
+        "GET data from the URI. The value is the response XML."
+        return self.submit(self.get, uri, params=params, callback=callback)
+
+    def aput(self, uri, data, params=dict(), callback=None):
+        "PUT the serialized XML to the URI. The value is the response XML."
+        return self.submit(self.put, uri, data, params=params,
+                           callback=callback)
+
+    def apost(self, uri, data, params=dict(), callback=None):
+        "POST the serialized XML to the URI. The value is the response XML."
+        return self.submit(self.post, uri, data, params=params,
+                           callback=callback)
+
+    def aget_batch(self, instances, errors=None, callback=None):
+        "Get the content of the instances by batch. See Lims.get_batch."
+        return self.submit(self.get_batch, list(instances), errors=errors,
+                           callback=callback)
+
+    def aload(self, instances, force=False, callback=None):
+        "Get the XML of the instances. See Lims.load."
+        return self.submit(self.load, list(instances), force=force,
+                           callback=callback)
+
+    def aflush(self, callback=None):
+        "Save the modified instances. See Lims.flush."
+        return self.submit(self.flush, callback=callback)
+
+    def aget_labs(self, callback=None, **kwargs):
+        "Get a list of labs. See Lims.get_labs."
+        return self.submit(self.get_labs, callback=callback, **kwargs)
+
+    def aget_researchers(self, callback=None, **kwargs):
+        "Get a list of researchers. See Lims.get_researchers."
+        return self.submit(self.get_researchers, callback=callback, **kwargs)
+
+    def aget_projects(self, callback=None, **kwargs):
+        "Get a list of projects. See Lims.get_projects."
+        return self.submit(self.get_projects, callback=callback, **kwargs)
+
+    def aget_samples(self, callback=None, **kwargs):
+        "Get a list of samples. See Lims.get_samples."
+        return self.submit(self.get_samples, callback=callback, **kwargs)
+
+    def aget_artifacts(self, callback=None, **kwargs):
+        "Get a list of artifacts. See Lims.get_artifacts."
+        return self.submit(self.get_artifacts, callback=callback, **kwargs)
+
+    def aget_containers(self, callback=None, **kwargs):
+        "Get a list of containers. See Lims.get_containers."
+        return self.submit(self.get_containers, callback=callback, **kwargs)
+
+    def aget_processes(self, callback=None, **kwargs):
+        "Get a list of processes. See Lims.get_processes."
+        return self.submit(self.get_processes, callback=callback, **kwargs)
+
+    def aiter_labs(self, **kwargs):
+        "Yield a PageResult for each page of labs. See aiter_pages."
+        return self.aiter_pages(Lab, self.get_labs, kwargs)
+
+    def aiter_researchers(self, **kwargs):
+        "Yield a PageResult for each page of researchers. See aiter_pages."
+        return self.aiter_pages(Researcher, self.get_researchers, kwargs)
+
+    def aiter_projects(self, **kwargs):
+        "Yield a PageResult for each page of projects. See aiter_pages."
+        return self.aiter_pages(Project, self.get_projects, kwargs)
+
+    def aiter_samples(self, **kwargs):
+        "Yield a PageResult for each page of samples. See aiter_pages."
+        return self.aiter_pages(Sample, self.get_samples, kwargs)
+
+    def aiter_artifacts(self, **kwargs):
+        "Yield a PageResult for each page of artifacts. See aiter_pages."
+        return self.aiter_pages(Artifact, self.get_artifacts, kwargs)
+
+    def aiter_containers(self, **kwargs):
+        "Yield a PageResult for each page of containers. See aiter_pages."
+        return self.aiter_pages(Container, self.get_containers, kwargs)
+
+    def aiter_processes(self, **kwargs):
+        "Yield a PageResult for each page of processes. See aiter_pages."
+        return self.aiter_pages(Process, self.get_processes, kwargs)
+
+    def aiter_pages(self, klass, method, kwargs):
+        """Yield a PageResult for each page of the list given by the query
+        of the get_* method; its value is the list of instances in the page.
+        Taking an item never waits: the end of the list is not known then,
+        so the iterator ends with a PageResult whose value is None, and the
+        caller must stop at it.
+        The pages are got in a thread of the pool, as by the iter_* methods:
+        a query with long filter lists is split by the query planner, and
+        the following pages are prefetched. A page is got at most one ahead
+        of the items taken, so memory stays bounded for a long list.
+        """
+        params = self._get_query_params(method, kwargs)
+        condition = threading.Condition()
+        results = []                    # Taken from the iterator, in order.
+        state = dict(pages=0, done=False, closed=False, error=None)
+        def get_pages():
+            try:
+                for uris in self._iter_pages(klass, params=params):
+                    with condition:     # Until its item has been taken.
+                        while not state['closed'] and \
+                              len(results) <= state['pages']:
+                            condition.wait()
+                        if state['closed']: return
+                        result = results[state['pages']]
+                        state['pages'] += 1
+                    result._set([klass(self, uri=uri) for uri in uris])
+            except Exception, error:
+                state['error'] = error
+            finally:
+                with condition:
+                    state['done'] = True
+                    pending = results[state['pages']:]
+                for result in pending:  # Past the end, or failed.
+                    result._set(None, state['error'])
+        self.submit(get_pages)
+        try:
+            while True:
+                with condition:
+                    if state['done'] and len(results) > state['pages']:
+                        return          # The end has been given.
+                    result = PageResult()
+                    if state['done']:
+                        result._set(None, state['error'])
+                    results.append(result)
+                    condition.notify()
+                yield result
+        finally:
+            with condition:
+                state['closed'] = True
+                condition.notify()
+
+
+class PageResult(object):
+    """The value of a page from an aiter_* iterator, when it is ready.
+    Has the methods of an AsyncResult.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._value = None
+        self._error = None
+
+    def _set(self, value, error=None):
+        self._value = value
+        self._error = error
+        self._event.set()
+
+    def ready(self):
+        return self._event.is_set()
+
+    def successful(self):
+        assert self.ready()
+        return self._error is None
+
+    def wait(self, timeout=None):
+        self._event.wait(timeout)
+
+    def get(self, timeout=None):
+        """Wait for and return the value, the list of instances in the page,
+        or None after the last page. Raise the exception if it failed."""
+        self.wait(timeout)
+        if not self.ready():
+            raise TimeoutError
+        if self._error is not None:
+            raise self._error
+        return self._value
@@ -0,0 +1,59 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: concurrent entity GETs by AsyncLims against a local stand-in
+server (module 'standin') with a given latency per request, compared with
+the time the same GETs would take one after the other. Also a page by
+page listing by aiter_samples.
+
+Usage: python concurrency.py [requests] [latency_ms] [concurrency]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import sys
+import time
+
+from genologics.asynclims import *
+from genologics.standin import StandinServer
+from genologics import synthetic
+
+
+def run(count=300, latency=0.2, concurrency=100):
+    server = StandinServer(latency=latency, page_size=100)
+    synthetic.populate(server, samples=count)
+    server.start()
+    try:
+        with AsyncLims(server.baseuri, 'username', 'password',
+                       concurrency=concurrency) as lims:
+            samples = [Sample(lims, id='SMP%d' % i) for i in xrange(count)]
+            started = time.time()
+            results = [sample.aget() for sample in samples]
+            names = [r.get().name for r in results]
+            seconds = time.time() - started
+            assert names == ['sample_%d' % i for i in xrange(count)]
+            print "%d concurrent GETs, %d in progress at most: %.2f s" \
+                  " (serial: %.2f s)" % (count, concurrency, seconds,
+                                         count * latency)
+            started = time.time()
+            listed = 0
+            for result in lims.aiter_samples():
+                page = result.get()
+                if page is None: break
+                listed += len(page)
+            assert listed == count
+            print "%d samples listed by pages: %.2f s" % \
+                  (listed, time.time() - started)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 2:
+        run(int(args[0]), float(args[1]) / 1000, int(args[2]))
+    elif len(args) > 1:
+        run(int(args[0]), float(args[1]) / 1000)
+    elif args:
+        run(int(args[0]))
+    else:
+        run()
@@ -0,0 +1,63 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: attribute access through the entity descriptors, comparing
+lookups directly in the ElementTree (as done before memoization), the
+first access after a load (one-pass field extraction and decoding),
+and repeated access of the memoized values.
+
+Usage: python descriptors.py [repeats]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import sys
+import timeit
+
+from genologics.lims import *
+from genologics.entities import ElementTree, nsmap
+from genologics import xmlbackend
+
+from xml_backends import DOCUMENTS, BASEURI
+
+lims = Lims(BASEURI.split('/api/')[0], 'username', 'password')
+root = ElementTree.fromstring(DOCUMENTS['artifact'])
+artifact = Artifact(lims, uri=root.attrib['uri'])
+artifact.root = root
+
+
+def direct():
+    "Lookups as done by the descriptors before memoization."
+    root.find('name').text
+    root.find('qc-flag').text
+    root.find('working-flag').text.lower() == 'true'
+    [Sample(lims, uri=node.attrib['uri']) for node in root.findall('sample')]
+    node = root.find('location')
+    (Container(lims, uri=node.find('container').attrib['uri']),
+     node.find('value').text)
+
+def access():
+    artifact.name
+    artifact.qc_flag
+    artifact.working_flag
+    artifact.samples
+    artifact.location
+
+def first_access():
+    artifact.root = root                # Resets the memoized values.
+    access()
+
+def run(repeats=20000):
+    print 'XML backend:', xmlbackend.BACKEND
+    print "%-14s %12s" % ('access', 'rounds/s')
+    for name, func in [('direct', direct),
+                       ('first', first_access),
+                       ('memoized', access)]:
+        seconds = min(timeit.repeat(func, number=repeats, repeat=3))
+        print "%-14s %12.0f" % (name, repeats / seconds)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        run()
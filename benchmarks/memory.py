@@ -0,0 +1,60 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: memory used per artifact instance, as an unloaded stub and
+as a loaded instance, in the default and the compact representation.
+
+Usage: python memory.py [count]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import gc
+import sys
+import resource
+
+from genologics.lims import *
+from genologics.entities import ElementTree
+
+from xml_backends import DOCUMENTS, BASEURI
+
+
+def get_rss():
+    "Return the current resident set size, in bytes."
+    try:
+        with open('/proc/self/statm') as infile:
+            pages = int(infile.read().split()[1])
+        return pages * resource.getpagesize()
+    except IOError:                     # Not Linux; use the peak instead.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(count, compact, load):
+    "Return the bytes per instance for the given number of artifacts."
+    lims = Lims(BASEURI.split('/api/')[0], 'username', 'password',
+                compact=compact)
+    document = DOCUMENTS['artifact']
+    gc.collect()
+    before = get_rss()
+    artifacts = []
+    for i in xrange(count):
+        uri = "%s/artifacts/2-%s" % (BASEURI, i)
+        artifact = Artifact(lims, uri=uri)
+        if load:
+            artifact.root = ElementTree.fromstring(document)
+        artifacts.append(artifact)
+    gc.collect()
+    return float(get_rss() - before) / count
+
+def run(count=100000):
+    print "%-10s %16s %16s" % ('', 'bytes/stub', 'bytes/loaded')
+    for compact in [False, True]:
+        stub = measure(count, compact, False)
+        loaded = measure(count / 10, compact, True)
+        print "%-10s %16.0f %16.0f" % (compact and 'compact' or 'default',
+                                       stub, loaded)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        run()
@@ -0,0 +1,136 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: throughput and memory against dataset size, for listing the
+artifacts, loading them by batch, decoding the input-output maps of the
+processes, and tracing the lineage of the final analytes, against a local
+stand-in server holding a synthetic dataset of the given number of
+artifacts. The server and the client run in separate processes, so that
+the memory of the client is measured alone. The results are plotted to
+'scaling.png' if matplotlib is installed.
+
+Usage: python scaling.py [artifacts ...]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import sys
+import time
+import resource
+import multiprocessing
+
+from genologics.lims import *
+from genologics.standin import StandinServer
+from genologics import synthetic
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib import pyplot
+except ImportError:
+    pyplot = None
+
+SIZES = (1000, 10000, 100000)
+OPERATIONS = ('list', 'batch', 'iomaps', 'lineage')
+
+
+def serve(artifacts, connection):
+    "Populate and run the stand-in server, until told to stop."
+    server = StandinServer(page_size=500)
+    synthetic.populate(server, samples=synthetic.get_samples(artifacts))
+    connection.send((server.start(), len(server.entities)))
+    connection.recv()
+    server.stop()
+
+def get_rss():
+    "Return the current resident set size, in bytes."
+    try:
+        with open('/proc/self/statm') as infile:
+            pages = int(infile.read().split()[1])
+        return pages * resource.getpagesize()
+    except IOError:                     # Not Linux; use the peak instead.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(baseuri, connection):
+    """Do the operations, and send a dictionary with the number of items
+    per second for each, and the memory in bytes."""
+    result = dict()
+    before = get_rss()
+    with Lims(baseuri, 'username', 'password') as lims:
+        started = time.time()
+        artifacts = lims.get_artifacts()
+        result['list'] = len(artifacts) / (time.time() - started)
+        started = time.time()
+        lims.get_batch(artifacts)
+        result['batch'] = len(artifacts) / (time.time() - started)
+        processes = lims.load(lims.get_processes())
+        started = time.time()
+        count = sum([len(p.input_output_maps) for p in processes])
+        result['iomaps'] = count / (time.time() - started)
+        suffix = "A%d" % (len(synthetic.STEPS) + 1)
+        final = [a for a in artifacts if a.id.endswith(suffix)]
+        started = time.time()
+        count = len(lims.trace_upstream(final))
+        result['lineage'] = count / (time.time() - started)
+        result['rss'] = get_rss() - before
+        result['resident'] = lims.cache_info()['resident_bytes']
+    connection.send(result)
+
+def run_size(artifacts):
+    "Return the measurements for the dataset size, in separate processes."
+    server_end, connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve,
+                                     args=(artifacts, server_end))
+    server.start()
+    try:
+        baseuri, entities = connection.recv()
+        client_end, result = multiprocessing.Pipe()
+        client = multiprocessing.Process(target=measure,
+                                         args=(baseuri, client_end))
+        client.start()
+        values = result.recv()
+        client.join()
+    finally:
+        connection.send('stop')
+        server.join()
+    values['entities'] = entities
+    return values
+
+def plot(sizes, results, filename='scaling.png'):
+    figure, (left, right) = pyplot.subplots(1, 2, figsize=(11, 4.5))
+    for operation in OPERATIONS:
+        left.loglog(sizes, [r[operation] for r in results], marker='o',
+                    label=operation)
+    left.set_xlabel('artifacts')
+    left.set_ylabel('items per second')
+    left.legend()
+    right.loglog(sizes, [r['rss'] / 1e6 for r in results], marker='o',
+                 label='client RSS growth')
+    right.loglog(sizes, [r['resident'] / 1e6 for r in results], marker='o',
+                 label='XML in cache (estimate)')
+    right.set_xlabel('artifacts')
+    right.set_ylabel('MB')
+    right.legend()
+    figure.tight_layout()
+    figure.savefig(filename)
+    return filename
+
+def run(sizes=SIZES):
+    print "%10s %9s" % ('artifacts', 'entities') + \
+          ''.join(["%10s/s" % o for o in OPERATIONS]) + \
+          "%10s %10s" % ('RSS MB', 'XML MB')
+    results = []
+    for size in sizes:
+        values = run_size(size)
+        results.append(values)
+        print "%10d %9d" % (size, values['entities']) + \
+              ''.join(["%12.0f" % values[o] for o in OPERATIONS]) + \
+              "%10.1f %10.1f" % (values['rss'] / 1e6, values['resident'] / 1e6)
+    if pyplot is not None:
+        print 'plot:', plot(sizes, results)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run([int(a) for a in sys.argv[1:]])
+    else:
+        run()
@@ -0,0 +1,133 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: transfer of file contents by Lims.transfer_files against a
+local stand-in server (module 'standin'), checking the behaviour of the
+module 'transfer': concurrent downloads, one of them resuming an
+interrupted download, whose partial file holds the first half of the
+contents; a download with a bad MD5 checksum; concurrent uploads; and
+an upload with a bad MD5 checksum. Reports the throughput, and the bytes
+received for the resumed download.
+
+Usage: python transfers.py [files] [size_kB]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+
+from genologics.lims import *
+from genologics.standin import StandinServer, BASEURI, VERSION
+
+FILE = '<file:file xmlns:file="http://genologics.com/ri/file"' \
+       ' uri="%s/api/%s/files/%s" limsid="%s">' \
+       '<content-location>sftp://localhost/%s.bin</content-location>' \
+       '<original-location>%s.bin</original-location>' \
+       '<is-published>false</is-published></file:file>'
+
+
+def populate(server, count, size, seed=0):
+    """Add File entities with random contents of the size to the server.
+    Return the list of their ids."""
+    rng = random.Random(seed)
+    ids = []
+    for i in xrange(count):
+        id = "FIL%d" % i
+        server.add('files', id, FILE % (BASEURI, VERSION, id, id, id, id))
+        server.contents[id] = ''.join([chr(rng.randint(0, 255))
+                                       for j in xrange(size)])
+        ids.append(id)
+    return ids
+
+def check(results, expected):
+    """Raise AssertionError if a transfer failed, or if its digest is not
+    the MD5 of the expected contents for its file."""
+    for file, digest, error in results:
+        assert error is None, "%s failed: %s" % (file.id, error)
+        assert digest == hashlib.md5(expected[file.id]).hexdigest(), file.id
+
+def run(count=8, size=1 << 20):
+    server = StandinServer()
+    ids = populate(server, count, size)
+    contents = dict(server.contents)
+    server.start()
+    directory = tempfile.mkdtemp()
+    received = set()                    # Bytes of each download.
+    def listener(event):
+        if event['endpoint'] == 'files/{id}/download':
+            received.add(event['bytes_received'])
+    try:
+        with Lims(server.baseuri, 'username', 'password') as lims:
+            lims.add_listener(listener)
+            files = [File(lims, id=id) for id in ids]
+            paths = dict([(id, os.path.join(directory, id + '.bin'))
+                          for id in ids])
+
+            # Downloads; the first was interrupted halfway before.
+            with open(paths[ids[0]] + '.part', 'wb') as outfile:
+                outfile.write(contents[ids[0]][:size / 2])
+            transfers = [(f, paths[f.id], hashlib.md5(contents[f.id])
+                          .hexdigest()) for f in files]
+            started = time.time()
+            results = lims.transfer_files(transfers)
+            seconds = time.time() - started
+            check(results, contents)
+            for id in ids:
+                with open(paths[id], 'rb') as infile:
+                    assert infile.read() == contents[id], id
+            assert size - size / 2 in received, 'download was not resumed'
+            print "%d downloads of %d kB: %.2f s, %.1f MB/s" % \
+                  (count, size / 1024, seconds,
+                   count * size / seconds / (1 << 20))
+            print "resumed download received %d of %d bytes" % \
+                  (size - size / 2, size)
+
+            # Download with a bad checksum; nothing is kept.
+            path = os.path.join(directory, 'bad.bin')
+            results = lims.transfer_files([(files[0], path, '0' * 32)])
+            assert isinstance(results[0][2], ValueError), results[0]
+            assert not os.path.exists(path)
+            assert not os.path.exists(path + '.part')
+            print "download with bad MD5: %s" % results[0][2]
+
+            # Uploads of new contents.
+            uploads = dict()
+            for id in ids:
+                uploads[id] = contents[id][::-1]
+                with open(paths[id], 'wb') as outfile:
+                    outfile.write(uploads[id])
+            transfers = [(f, paths[f.id], hashlib.md5(uploads[f.id])
+                          .hexdigest()) for f in files]
+            started = time.time()
+            results = lims.transfer_files(transfers, upload=True)
+            seconds = time.time() - started
+            check(results, uploads)
+            for id in ids:
+                assert server.contents[id] == uploads[id], id
+            print "%d uploads of %d kB: %.2f s, %.1f MB/s" % \
+                  (count, size / 1024, seconds,
+                   count * size / seconds / (1 << 20))
+
+            # Upload with a bad checksum; the file was changed since.
+            results = lims.transfer_files([(files[0], paths[ids[0]],
+                                            '0' * 32)], upload=True)
+            assert isinstance(results[0][2], ValueError), results[0]
+            print "upload with bad MD5: %s" % results[0][2]
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 1:
+        run(int(args[0]), int(args[1]) * 1024)
+    elif args:
+        run(int(args[0]))
+    else:
+        run()
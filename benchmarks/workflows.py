@@ -0,0 +1,131 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: the workflows of the example scripts, run against a local
+stand-in server (module 'standin') holding a generated dataset (module
+'synthetic'), reporting the number of requests, wall time and growth of
+the peak RSS. Also the request rate with and without persistent
+connections.
+
+Usage: python workflows.py [samples] [latency_ms]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import sys
+import time
+import resource
+from multiprocessing.pool import ThreadPool
+
+from genologics.lims import *
+from genologics.standin import StandinServer
+from genologics import synthetic
+
+
+def samples_naive(lims):
+    "Sample name, project and UDFs, one attribute access at a time."
+    for sample in lims.get_samples():
+        sample.name, sample.project.name, sample.udf.items()
+
+def samples_prefetch(lims):
+    "As samples_naive, but loading all by prefetch first."
+    samples = lims.prefetch(lims.get_samples(), 'project', 'artifact')
+    for sample in samples:
+        sample.name, sample.project.name, sample.udf.items()
+
+def artifacts_batch(lims):
+    "Get artifacts by batch, as in the example get_artifacts."
+    for artifact in lims.get_batch(lims.get_artifacts()):
+        artifact.name, artifact.get_state(), artifact.qc_flag
+
+def containers_placements(lims):
+    "Placements of each container, as in the example get_containers."
+    for container in lims.get_containers():
+        for location, artifact in container.get_placements().iteritems():
+            artifact.name
+
+def containers_layouts(lims):
+    "As containers_placements, but by get_layouts."
+    for layout in lims.get_layouts(lims.get_containers()):
+        for name, artifact in layout.wells():
+            artifact.name
+
+def genealogy(lims):
+    "Trace the analytes of the last step back to the submitted analytes."
+    suffix = "A%d" % (len(synthetic.STEPS) + 1)
+    final = [a for a in lims.get_artifacts() if a.id.endswith(suffix)]
+    lims.trace_upstream(final)
+
+def rename_samples(lims):
+    "Modify the sample names and save, as in the example set_sample_name."
+    samples = lims.get_batch(lims.get_samples())
+    for sample in samples:
+        sample.name = sample.name + '_x'
+    lims.flush()
+
+WORKFLOWS = [samples_naive, samples_prefetch, artifacts_batch,
+             containers_placements, containers_layouts, genealogy,
+             rename_samples]
+
+
+def get_peak_rss():
+    "Return the peak resident set size of the process, in bytes."
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(server, workflow, **kwargs):
+    "Return the number of requests, seconds and peak RSS growth."
+    with Lims(server.baseuri, 'username', 'password', **kwargs) as lims:
+        peak = get_peak_rss()
+        started = time.time()
+        workflow(lims)
+        seconds = time.time() - started
+        requests = sum([s['count'] for s in lims.stats()['requests'].values()])
+    return requests, seconds, get_peak_rss() - peak
+
+def request_rate(server, keep_alive, workers, count):
+    "Return the number of entity GETs per second."
+    with Lims(server.baseuri, 'username', 'password', keep_alive=keep_alive,
+              pool_size=workers) as lims:
+        uris = [lims.get_uri('samples', 'SMP%d' % (i % 96))
+                for i in xrange(count)]
+        started = time.time()
+        if workers > 1:
+            pool = ThreadPool(workers)  # Not the pool used within Lims.
+            try:
+                pool.map(lims.get, uris)
+            finally:
+                pool.terminate()
+        else:
+            for u in uris:
+                lims.get(u)
+        return count / (time.time() - started)
+
+def run(samples=960, latency=0.0):
+    server = StandinServer(latency=latency, page_size=500)
+    synthetic.populate(server, samples=samples)
+    server.start()
+    try:
+        print "%-22s %10s %10s %12s" % ('workflow', 'requests', 'seconds',
+                                        'peak RSS +kB')
+        for workflow in WORKFLOWS:
+            requests, seconds, rss = measure(server, workflow)
+            print "%-22s %10d %10.2f %12.0f" % (workflow.__name__, requests,
+                                                seconds, rss / 1024.0)
+        print
+        print "%-22s %10s %10s" % ('connections', 'workers', 'GET/s')
+        for keep_alive in [False, True]:
+            for workers in [1, 4]:
+                rate = request_rate(server, keep_alive, workers, 500)
+                print "%-22s %10d %10.0f" % (keep_alive and 'persistent' or
+                                             'new per request', workers, rate)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if len(args) > 1:
+        run(int(args[0]), float(args[1]) / 1000)
+    elif args:
+        run(int(args[0]))
+    else:
+        run()
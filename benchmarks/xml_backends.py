@@ -0,0 +1,167 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Benchmark: parse, find and serialize throughput of the XML backends
+available (ElementTree, cElementTree, lxml) on realistic sample, artifact
+and process documents.
+
+Usage: python xml_backends.py [repeats]
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+"""
+
+import sys
+import timeit
+from cStringIO import StringIO
+
+BASEURI = 'https://lims.example.org:8443/api/v1'
+
+SAMPLE = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:sample xmlns:udf="http://genologics.com/ri/userdefined"
+ xmlns:ri="http://genologics.com/ri" xmlns:file="http://genologics.com/ri/file"
+ xmlns:smp="http://genologics.com/ri/sample"
+ uri="%(base)s/samples/KRA61A1" limsid="KRA61A1">
+<name>spruce_a</name>
+<date-received>2012-05-02</date-received>
+<date-completed>2012-06-21</date-completed>
+<project limsid="KRA61" uri="%(base)s/projects/KRA61"/>
+<submitter uri="%(base)s/researchers/3"/>
+<artifact limsid="KRA61A1PA1" uri="%(base)s/artifacts/KRA61A1PA1?state=1207"/>
+%(udfs)s
+<file:file limsid="40-1" uri="%(base)s/files/40-1"/>
+<externalid id="ext-1" uri="http://external.example.org/1"/>
+</smp:sample>
+"""
+
+ARTIFACT = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<art:artifact xmlns:udf="http://genologics.com/ri/userdefined"
+ xmlns:file="http://genologics.com/ri/file"
+ xmlns:art="http://genologics.com/ri/artifact"
+ uri="%(base)s/artifacts/2-1000?state=1500" limsid="2-1000">
+<name>spruce_a lib</name>
+<type>Analyte</type>
+<output-type>Analyte</output-type>
+<parent-process limsid="24-100" uri="%(base)s/processes/24-100"/>
+<qc-flag>PASSED</qc-flag>
+<location>
+<container limsid="27-10" uri="%(base)s/containers/27-10"/>
+<value>B:3</value>
+</location>
+<working-flag>true</working-flag>
+<sample limsid="KRA61A1" uri="%(base)s/samples/KRA61A1"/>
+%(udfs)s
+</art:artifact>
+"""
+
+PROCESS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<prc:process xmlns:udf="http://genologics.com/ri/userdefined"
+ xmlns:prc="http://genologics.com/ri/process"
+ uri="%(base)s/processes/24-100" limsid="24-100">
+<type uri="%(base)s/processtypes/5">Library Prep</type>
+<date-run>2012-06-01</date-run>
+<technician uri="%(base)s/researchers/3"/>
+%(maps)s
+%(udfs)s
+</prc:process>
+"""
+
+UDF = """<udf:field type="%s" name="%s">%s</udf:field>"""
+
+MAP = """<input-output-map>
+<input post-process-uri="%(base)s/artifacts/2-%(i)s?state=2%(i)s"
+ uri="%(base)s/artifacts/2-%(i)s?state=1%(i)s" limsid="2-%(i)s">
+<parent-process uri="%(base)s/processes/24-99" limsid="24-99"/>
+</input>
+<output uri="%(base)s/artifacts/2-9%(i)s?state=3%(i)s"
+ output-generation-type="PerInput" output-type="Analyte" limsid="2-9%(i)s"/>
+</input-output-map>"""
+
+def make_udfs(count):
+    udfs = []
+    for i in xrange(count):
+        type, value = [('String', 'value %s' % i),
+                       ('Numeric', '%s.5' % i),
+                       ('Boolean', 'true'),
+                       ('Date', '2012-06-%02i' % (i % 28 + 1))][i % 4]
+        udfs.append(UDF % (type, 'UDF %s' % i, value))
+    return '\n'.join(udfs)
+
+DOCUMENTS = dict(
+    sample=SAMPLE % dict(base=BASEURI, udfs=make_udfs(20)),
+    artifact=ARTIFACT % dict(base=BASEURI, udfs=make_udfs(10)),
+    process=PROCESS % dict(base=BASEURI, udfs=make_udfs(10),
+                           maps='\n'.join([MAP % dict(base=BASEURI, i=i)
+                                           for i in xrange(96)])))
+
+UDF_FIELD = '{http://genologics.com/ri/userdefined}field'
+FIND_TAGS = dict(sample=['name', 'project', 'artifact', 'date-received'],
+                 artifact=['name', 'qc-flag', 'location', 'sample'],
+                 process=['type', 'date-run', 'technician'])
+FINDALL_TAGS = dict(sample=[UDF_FIELD],
+                    artifact=[UDF_FIELD],
+                    process=['input-output-map', UDF_FIELD])
+
+
+def get_backends():
+    "Return a list of tuples (name, module) for the available backends."
+    result = []
+    from xml.etree import ElementTree
+    result.append(('ElementTree', ElementTree))
+    try:
+        from xml.etree import cElementTree
+        result.append(('cElementTree', cElementTree))
+    except ImportError:
+        pass
+    try:
+        from lxml import etree
+        result.append(('lxml', etree))
+        result.append(('lxml+XPath', etree))
+    except ImportError:
+        pass
+    return result
+
+def get_finders(name, module, tags, all=False):
+    "Return a list of functions finding the tags in a node."
+    if name == 'lxml+XPath':
+        result = []
+        for tag in tags:
+            if tag.startswith('{'):
+                uri, local = tag[1:].split('}')
+                result.append(module.XPath('ns:' + local,
+                                           namespaces=dict(ns=uri)))
+            else:
+                result.append(module.XPath(tag))
+        return result
+    elif all:
+        return [lambda node, tag=tag: node.findall(tag) for tag in tags]
+    else:
+        return [lambda node, tag=tag: node.find(tag) for tag in tags]
+
+def run(repeats=2000):
+    print "%-14s %-9s %12s %12s %12s" % ('backend', 'document',
+                                          'parse/s', 'find/s', 'serialize/s')
+    for name, module in get_backends():
+        for kind in ['sample', 'artifact', 'process']:
+            document = DOCUMENTS[kind]
+            root = module.fromstring(document)
+            finders = get_finders(name, module, FIND_TAGS[kind]) + \
+                      get_finders(name, module, FINDALL_TAGS[kind], all=True)
+            def parse():
+                module.fromstring(document)
+            def find():
+                for finder in finders:
+                    finder(root)
+            def serialize():
+                module.ElementTree(root).write(StringIO(), encoding='UTF-8')
+            rates = []
+            for func in [parse, find, serialize]:
+                seconds = min(timeit.repeat(func, number=repeats, repeat=3))
+                rates.append(repeats / seconds)
+            print "%-14s %-9s %12.0f %12.0f %12.0f" % ((name, kind) +
+                                                        tuple(rates))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(int(sys.argv[1]))
+    else:
+        run()
@@ -0,0 +1,145 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Identity map of entity instances for the LIMS interface.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import sys
+import weakref
+import threading
+import collections
+
+
+class EntityCache(object):
+    """Identity map of the entity instances, keyed by URI.
+    The policy determines what is kept in memory:
+    'unbounded': All instances and their XML are kept.
+    'weak': Instances are kept only while referenced outside the cache.
+    'lru': All instances are kept, but only the 'size' most recently used
+           have their XML kept; the others are reset to unloaded stubs,
+           and will get their XML again when required. Use is recorded
+           when the XML is accessed, not when a memoized attribute value
+           is read.
+    Instances that have been modified but not saved are never evicted.
+    """
+
+    POLICIES = ('unbounded', 'weak', 'lru')
+
+    def __init__(self, policy='unbounded', size=10000):
+        if policy not in self.POLICIES:
+            raise ValueError("invalid cache policy '%s'" % policy)
+        self.policy = policy
+        self.size = size
+        if policy == 'weak':
+            self._instances = weakref.WeakValueDictionary()
+        else:
+            self._instances = dict()
+        self._loaded = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, uri):
+        try:
+            instance = self._instances[uri]
+        except KeyError:
+            self.misses += 1
+            raise
+        self.hits += 1
+        return instance
+
+    def __setitem__(self, uri, instance):
+        self._instances[uri] = instance
+
+    def __delitem__(self, uri):
+        del self._instances[uri]
+
+    def __contains__(self, uri):
+        return uri in self._instances
+
+    def __len__(self):
+        return len(self._instances)
+
+    def __iter__(self):
+        return iter(self._instances.keys())
+
+    def get(self, uri, default=None):
+        return self._instances.get(uri, default)
+
+    def setdefault(self, uri, instance):
+        """Put the instance in the cache, unless there is one for the URI.
+        Return the instance in the cache. Atomic, so that concurrent calls
+        for the same URI all return the same instance."""
+        with self._lock:
+            return self._instances.setdefault(uri, instance)
+
+    def keys(self):
+        return self._instances.keys()
+
+    def values(self):
+        return self._instances.values()
+
+    def items(self):
+        return self._instances.items()
+
+    def clear(self):
+        self._instances.clear()
+        with self._lock:
+            self._loaded.clear()
+
+    def loaded(self, instance):
+        "Record that the instance has got its XML."
+        if self.policy != 'lru': return
+        with self._lock:
+            self._loaded.pop(instance, None)
+            self._loaded[instance] = True
+            self._evict()
+
+    def touch(self, instance):
+        "Record that the XML of the instance has been used."
+        if self.policy != 'lru': return
+        with self._lock:
+            if self._loaded.pop(instance, None):
+                self._loaded[instance] = True
+
+    def _evict(self):
+        "Reset the least recently used instances beyond the size limit."
+        keep = []
+        while len(self._loaded) > self.size:
+            instance = self._loaded.popitem(last=False)[0]
+            if instance.is_dirty:
+                keep.append(instance)
+                continue
+            instance.root = None
+            self.evictions += 1
+        for instance in keep:
+            self._loaded[instance] = True
+
+    def info(self):
+        "Return a dictionary of statistics for the cache."
+        instances = self._instances.values()
+        loaded = [i for i in instances if i._root is not None]
+        return dict(policy=self.policy,
+                    instances=len(instances),
+                    loaded=len(loaded),
+                    hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    resident_bytes=sum([sizeof_tree(i._root) for i in loaded]))
+
+
+def sizeof_tree(root):
+    "Return an estimate of the number of bytes used by the XML tree."
+    result = 0
+    for elem in root.iter():
+        result += sys.getsizeof(elem) + sys.getsizeof(elem.attrib)
+        if elem.text:
+            result += sys.getsizeof(elem.text)
+        if elem.tail:
+            result += sys.getsizeof(elem.tail)
+        for value in elem.attrib.itervalues():
+            result += sys.getsizeof(value)
+    return result
@@ -10,7 +10,10 @@ import re
 import urlparse
 import datetime
 import time
-from xml.etree import ElementTree
+import collections
+
+from .xmlbackend import ElementTree, register_namespace
+from .xmlbackend import compile_find, compile_findall
 
 _NSMAP = dict(
     artgr='http://genologics.com/ri/artifactgroup',
@@ -36,7 +39,7 @@ _NSMAP = dict(
     ver='http://genologics.com/ri/version')
 
 for prefix, uri in _NSMAP.iteritems():
-    ElementTree._namespace_map[uri] = prefix
+    register_namespace(prefix, uri)
 
 _NSPATTERN = re.compile(r'(\{)(.+?)(\})')
 
@@ -47,11 +50,44 @@ def nsmap(tag):
         raise ValueError("no namespace specifier in tag")
     return "{%s}%s" % (_NSMAP[parts[0]], parts[1])
 
+_MISSING = object()                     # Marker for a value not memoized.
+_NODES = object()                       # Key for the memoized child elements.
+
+def _intern(string):
+    "Return the interned string, if it can be interned."
+    if type(string) is str:
+        return intern(string)
+    else:
+        return string
+
+
+class _Unloaded(dict):
+    "Empty, read-only memo of attribute values for instances not loaded."
+
+    def __setitem__(self, key, value):
+        raise TypeError('instance not loaded')
+
+_UNLOADED = _Unloaded()
+
+_find_udt = compile_find(nsmap('udf:type'))
+_findall_udf = compile_findall(nsmap('udf:field'))
+
 
 class BaseDescriptor(object):
-    "Abstract base descriptor for an instance attribute."
+    """Abstract base descriptor for an instance attribute.
+    The decoded value is memoized in the instance, until its XML is reset.
+    """
 
     def __get__(self, instance, cls):
+        if instance is None: return self
+        value = instance._values.get(self, _MISSING)
+        if value is _MISSING:
+            instance.get()
+            value = instance._values[self] = self.decode(instance)
+        return value
+
+    def decode(self, instance):
+        "Return the value of the attribute from the XML of the instance."
         raise NotImplementedError
 
 
@@ -63,14 +99,24 @@ class TagDescriptor(BaseDescriptor):
     def __init__(self, tag):
         self.tag = tag
 
+    def get_node(self, instance):
+        "Return the first XML element for the attribute, or None."
+        if self.tag:
+            nodes = instance.get_nodes(self.tag)
+            if nodes:
+                return nodes[0]
+            else:
+                return None
+        else:
+            return instance.root
+
 
 class StringDescriptor(TagDescriptor):
     """An instance attribute containing a string value
     represented by an XML element.
     """
 
-    def __get__(self, instance, cls):
-        instance.get()
+    def decode(self, instance):
         node = self.get_node(instance)
         if node is None:
             return None
@@ -78,17 +124,14 @@ class StringDescriptor(TagDescriptor):
             return node.text
 
     def __set__(self, instance, value):
+        instance.get()
         node = self.get_node(instance)
         if node is None:
             raise AttributeError("no element '%s' to set" % self.tag)
         else:
             node.text = value
-
-    def get_node(self, instance):
-        if self.tag:
-            return instance.root.find(self.tag)
-        else:
-            return instance.root
+            instance._values.pop(self, None)
+            instance.set_dirty()
 
 
 class StringAttributeDescriptor(TagDescriptor):
@@ -96,8 +139,7 @@ class StringAttributeDescriptor(TagDescriptor):
     represented by an XML attribute.
     """
 
-    def __get__(self, instance, cls):
-        instance.get()
+    def decode(self, instance):
         return instance.root.attrib[self.tag]
 
 
@@ -107,11 +149,12 @@ class StringListDescriptor(TagDescriptor):
     """
 
     def __get__(self, instance, cls):
-        instance.get()
-        result = []
-        for node in instance.root.findall(self.tag):
-            result.append(node.text)
-        return result
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return list(result)
+
+    def decode(self, instance):
+        return tuple([node.text for node in instance.get_nodes(self.tag)])
 
 
 class StringDictionaryDescriptor(TagDescriptor):
@@ -120,9 +163,13 @@ class StringDictionaryDescriptor(TagDescriptor):
     """
 
     def __get__(self, instance, cls):
-        instance.get()
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return result.copy()
+
+    def decode(self, instance):
         result = dict()
-        node = instance.root.find(self.tag)
+        node = self.get_node(instance)
         if node is not None:
             for node2 in node.getchildren():
                 result[node2.tag] = node2.text
@@ -134,8 +181,7 @@ class IntegerDescriptor(StringDescriptor):
     represented by an XMl element.
     """
 
-    def __get__(self, instance, cls):
-        instance.get()
+    def decode(self, instance):
         node = self.get_node(instance)
         if node is None:
             return None
@@ -148,8 +194,7 @@ class BooleanDescriptor(StringDescriptor):
     represented by an XMl element.
     """
 
-    def __get__(self, instance, cls):
-        instance.get()
+    def decode(self, instance):
         node = self.get_node(instance)
         if node is None:
             return None
@@ -158,13 +203,15 @@ class BooleanDescriptor(StringDescriptor):
 
 
 class UdfDictionary(object):
-    "Dictionary-like container of UDFs, optionally within a UDT."
+    """Dictionary-like container of UDFs, optionally within a UDT.
+    The UDF elements are indexed by name, and their values are decoded
+    on first access.
+    """
 
     def __init__(self, instance, udt=False):
         self.instance = instance
         self._udt = udt
         self._update_elems()
-        self._prepare_lookup()
 
     def get_udt(self):
         if self._udt == True:
@@ -177,117 +224,179 @@ class UdfDictionary(object):
         if not self._udt:
             raise AttributeError('cannot set name for a UDF dictionary')
         self._udt = name
-        elem = self.instance.root.find(nsmap('udf:type'))
+        elem = _find_udt(self.instance.root)
         assert elem is not None
         elem.set('name', name)
+        self.instance.set_dirty()
 
     udt = property(get_udt, set_udt)
 
     def _update_elems(self):
-        self._elems = []
+        "Index the UDF elements by name; the first one of a name is used."
+        self._index = collections.OrderedDict()
+        self._values = dict()
         if self._udt:
-            elem = self.instance.root.find(nsmap('udf:type'))
-            if elem is not None:
-                self._udt = elem.attrib['name']
-                self._elems = elem.findall(nsmap('udf:field'))
+            self._parent = _find_udt(self.instance.root)
+            if self._parent is None: return
+            self._udt = self._parent.attrib['name']
+            elems = _findall_udf(self._parent)
         else:
+            self._parent = self.instance.root
             tag = nsmap('udf:field')
-            for elem in self.instance.root.getchildren():
-                if elem.tag == tag:
-                    self._elems.append(elem)
-
-    def _prepare_lookup(self):
-        self._lookup = dict()
-        for elem in self._elems:
-            type = elem.attrib['type'].lower()
-            value = elem.text
-            if not value:
-                value = None
-            elif type == 'numeric':
-                try:
-                    value = int(value)
-                except ValueError:
-                    value = float(value)
-            elif type == 'boolean':
-                value = value == 'true'
-            elif type == 'date':
-                value = datetime.date(*time.strptime(value, "%Y-%m-%d")[:3])
-            self._lookup[elem.attrib['name']] = value
+            elems = [e for e in self._parent.getchildren() if e.tag == tag]
+        for elem in elems:
+            self._index.setdefault(elem.attrib['name'], elem)
 
     def __getitem__(self, key):
-        return self._lookup[key]
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = _decode_udf(self._index[key])
+            return value
 
     def __setitem__(self, key, value):
-        self._lookup[key] = value
-        for node in self._elems:
-            if node.attrib['name'] != key: continue
-            type = node.attrib['type'].lower()
-            if value is None:
-                pass
-            elif type == 'string':
-                if not isinstance(value, basestring):
-                    raise TypeError('String UDF requires str or unicode value')
-            elif type == 'text':
-                if not isinstance(value, basestring):
-                    raise TypeError('Text UDF requires str or unicode value')
-            elif type == 'numeric':
-                if not isinstance(value, (int, float)):
-                    raise TypeError('Numeric UDF requires int or float value')
-                value = str(value)
-            elif type == 'boolean':
-                if not isinstance(value, bool):
-                    raise TypeError('Boolean UDF requires bool value')
-                value = value and 'True' or 'False'
-            elif type == 'date':
-                if not isinstance(value, datetime.date): # Too restrictive?
-                    raise TypeError('Date UDF requires datetime.date value')
-                value = str(value)
-            else:
-                raise NotImplemented("UDF type '%s'" % type)
-            if not isinstance(value, unicode):
-                value = unicode(value, 'UTF-8')
-            node.text = value
-            break
+        self._set(key, value)
+        self.instance.set_dirty()
+
+    def _set(self, key, value):
+        """Set the value in the XML element, or in a new one.
+        Nothing is changed if the value is not valid for the type."""
+        elem = self._index.get(key)
+        if elem is not None:
+            text = _encode_udf(elem.attrib['type'].lower(), value)
         else:                           # Create new entry; heuristics for type
+            if self._parent is None:
+                raise KeyError("no UDT element for UDF '%s'" % key)
             if isinstance(value, basestring):
                 type = '\n' in value and 'Text' or 'String'
-            elif isinstance(value, (int, float)):
-                type = 'Numeric'
             elif isinstance(value, bool):
                 type = 'Boolean'
-                value = value and 'True' or 'False'
+            elif isinstance(value, (int, float)):
+                type = 'Numeric'
             elif isinstance(value, datetime.date):
                 type = 'Date'
-                value = str(value)
             else:
+                name = value.__class__.__name__
                 raise NotImplementedError("Cannot handle value of type '%s'"
-                                          " for UDF" % type(value))
-            if self._udt:
-                root = self._instance.root.find(nsmap('udf:type'))
-            else:
-                root = self._instance.root
-            elem = ElementTree.SubElement(root,
+                                          " for UDF" % name)
+            text = _encode_udf(type.lower(), value)
+            elem = ElementTree.SubElement(self._parent,
                                           nsmap('udf:field'),
                                           type=type,
                                           name=key)
-            if not isinstance(value, unicode):
-                value = unicode(value, 'UTF-8')
-            elem.text = value
+            self._index[key] = elem
+        elem.text = text
+        self._values[key] = value
 
     def __delitem__(self, key):
-        del self._lookup[key]
-        for node in self._elems:
-            if node.attrib['name'] == key:
-                self._instance.root.remove(node)
-                break
+        elem = self._index.pop(key)
+        self._values.pop(key, None)
+        self._parent.remove(elem)
+        self.instance.set_dirty()
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self._index.keys()
+
+    def values(self):
+        return [self[key] for key in self._index]
 
     def items(self):
-        return self._lookup.items()
+        return [(key, self[key]) for key in self._index]
+
+    def update(self, values=(), **kwargs):
+        """Set the values given as a dictionary or a sequence of
+        (name, value) pairs, and as keyword arguments. If a value is not
+        valid, those set before it remain set."""
+        if hasattr(values, 'items'):
+            values = values.items()
+        changed = False
+        try:
+            for key, value in list(values) + kwargs.items():
+                self._set(key, value)
+                changed = True
+        finally:
+            if changed:
+                self.instance.set_dirty()
+
+    def to_dict(self):
+        "Return a dictionary of the decoded values."
+        return dict(self.items())
 
     def clear(self):
-        for elem in self._elems:
-            self.instance.root.remove(elem)
+        for elem in self._index.itervalues():
+            self._parent.remove(elem)
         self._update_elems()
+        self.instance.set_dirty()
+
+
+def _parse_date(value):
+    "Return the date of the ISO format string; fast path for 'YYYY-MM-DD'."
+    if len(value) == 10 and value[4] == '-' and value[7] == '-':
+        try:
+            return datetime.date(int(value[:4]), int(value[5:7]),
+                                 int(value[8:]))
+        except ValueError:
+            pass
+    return datetime.date(*time.strptime(value, "%Y-%m-%d")[:3])
+
+def _decode_udf(elem):
+    "Return the value of the UDF element, converted according to its type."
+    value = elem.text
+    if not value:
+        return None
+    type = elem.attrib['type'].lower()
+    if type == 'numeric':
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    elif type == 'boolean':
+        return value.lower() == 'true'
+    elif type == 'date':
+        return _parse_date(value)
+    else:
+        return value
+
+def _encode_udf(type, value):
+    "Return the text of the UDF value, checked against the type."
+    if value is None:
+        return None
+    elif type in ('string', 'text'):
+        if not isinstance(value, basestring):
+            raise TypeError("%s UDF requires str or unicode value" %
+                            type.capitalize())
+    elif type == 'numeric':
+        if not isinstance(value, (int, float)):
+            raise TypeError('Numeric UDF requires int or float value')
+        value = str(value)
+    elif type == 'boolean':
+        if not isinstance(value, bool):
+            raise TypeError('Boolean UDF requires bool value')
+        value = value and 'True' or 'False'
+    elif type == 'date':
+        if not isinstance(value, datetime.date): # Too restrictive?
+            raise TypeError('Date UDF requires datetime.date value')
+        value = str(value)
+    elif not isinstance(value, basestring):
+        raise NotImplementedError("UDF type '%s'" % type)
+    if not isinstance(value, unicode):
+        value = unicode(value, 'UTF-8')
+    return value
 
 
 class UdfDictionaryDescriptor(BaseDescriptor):
@@ -297,13 +406,8 @@ class UdfDictionaryDescriptor(BaseDescriptor):
 
     _UDT = False
 
-    def __get__(self, instance, cls):
-        try:
-            return self.value
-        except AttributeError:
-            instance.get()
-            self.value = UdfDictionary(instance, udt=self._UDT)
-            return self.value
+    def decode(self, instance):
+        return UdfDictionary(instance, udt=self._UDT)
 
 
 class UdtDictionaryDescriptor(UdfDictionaryDescriptor):
@@ -320,28 +424,34 @@ class PlacementDictionaryDescriptor(TagDescriptor):
     """
 
     def __get__(self, instance, cls):
-        try:
-            return self.value
-        except AttributeError:
-            instance.get()
-            self.value = dict()
-            for node in instance.root.findall(self.tag):
-                key = node.find('value').text
-                self.value[key] = Artifact(instance.lims,uri=node.attrib['uri'])
-            return self.value
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return result.copy()
+
+    def decode(self, instance):
+        result = dict()
+        for node in instance.get_nodes(self.tag):
+            key = node.find('value').text
+            result[key] = Artifact(instance.lims, uri=node.attrib['uri'])
+        return result
 
 
-class ExternalidListDescriptor(BaseDescriptor):
+class ExternalidListDescriptor(TagDescriptor):
     """An instance attribute yielding a list of tuples (id, uri) for
     external identifiers represented by multiple XML elements.
     """
 
+    def __init__(self):
+        super(ExternalidListDescriptor, self).__init__(nsmap('ri:externalid'))
+
     def __get__(self, instance, cls):
-        instance.get()
-        result = []
-        for node in instance.root.findall(nsmap('ri:externalid')):
-            result.append((node.attrib.get('id'), node.attrib.get('uri')))
-        return result
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return list(result)
+
+    def decode(self, instance):
+        return tuple([(node.attrib.get('id'), node.attrib.get('uri'))
+                      for node in instance.get_nodes(self.tag)])
 
 
 class EntityDescriptor(TagDescriptor):
@@ -351,9 +461,8 @@ class EntityDescriptor(TagDescriptor):
         super(EntityDescriptor, self).__init__(tag)
         self.klass = klass
 
-    def __get__(self, instance, cls):
-        instance.get()
-        node = instance.root.find(self.tag)
+    def decode(self, instance):
+        node = self.get_node(instance)
         return self.klass(instance.lims, uri=node.attrib['uri'])
 
 
@@ -363,11 +472,13 @@ class EntityListDescriptor(EntityDescriptor):
     """
 
     def __get__(self, instance, cls):
-        instance.get()
-        result = []
-        for node in instance.root.findall(self.tag):
-            result.append(self.klass(instance.lims, uri=node.attrib['uri']))
-        return result
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return list(result)
+
+    def decode(self, instance):
+        return tuple([self.klass(instance.lims, uri=node.attrib['uri'])
+                      for node in instance.get_nodes(self.tag)])
 
 
 class DimensionDescriptor(TagDescriptor):
@@ -376,8 +487,12 @@ class DimensionDescriptor(TagDescriptor):
     """
 
     def __get__(self, instance, cls):
-        instance.get()
-        node = instance.root.find(self.tag)
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return result.copy()
+
+    def decode(self, instance):
+        node = self.get_node(instance)
         return dict(is_alpha = node.find('is-alpha').text.lower() == 'true',
                     offset = int(node.find('offset').text),
                     size = int(node.find('size').text))
@@ -388,30 +503,33 @@ class LocationDescriptor(TagDescriptor):
     specifying the location of an analyte in a container.
     """
 
-    def __get__(self, instance, cls):
-        instance.get()
-        node = instance.root.find(self.tag)
+    def decode(self, instance):
+        node = self.get_node(instance)
         uri = node.find('container').attrib['uri']
         return Container(instance.lims, uri=uri), node.find('value').text
 
 
-class InputOutputMapList(BaseDescriptor):
+class InputOutputMapList(TagDescriptor):
     """An instance attribute yielding a list of tuples (input, output)
     where each item is a dictionary, representing the input/output
     maps of a Process instance.
     """
 
+    def __init__(self):
+        super(InputOutputMapList, self).__init__('input-output-map')
+
     def __get__(self, instance, cls):
-        try:
-            return self.value
-        except AttributeError:
-            instance.get()
-            self.value = []
-            for node in instance.root.findall('input-output-map'):
-                input = self.get_dict(instance.lims, node.find('input'))
-                output = self.get_dict(instance.lims, node.find('output'))
-                self.value.append((input, output))
-            return self.value
+        result = BaseDescriptor.__get__(self, instance, cls)
+        if instance is None: return result
+        return list(result)
+
+    def decode(self, instance):
+        result = []
+        for node in instance.get_nodes(self.tag):
+            input = self.get_dict(instance.lims, node.find('input'))
+            output = self.get_dict(instance.lims, node.find('output'))
+            result.append((input, output))
+        return tuple(result)
 
     def get_dict(self, lims, node):
         if node is None: return None
@@ -421,11 +539,11 @@ class InputOutputMapList(BaseDescriptor):
                 result[key] = node.attrib[key]
             except KeyError:
                 pass
-            for uri in ['uri', 'post-process-uri']:
-                try:
-                    result[uri] = Artifact(lims, uri=node.attrib[uri])
-                except KeyError:
-                    pass
+        for uri in ['uri', 'post-process-uri']:
+            try:
+                result[uri] = Artifact(lims, uri=node.attrib[uri])
+            except KeyError:
+                pass
         node = node.find('parent-process')
         if node is not None:
             result['parent-process'] = Process(lims, node.attrib['uri'])
@@ -437,25 +555,39 @@ class Entity(object):
 
     _TAG = None
     _URI = None
+    _BATCH = False                      # Batch retrieve/update endpoints?
+
+    __slots__ = ('lims', '_uri', '_id', '_root', '_values', '__weakref__')
 
     def __new__(cls, lims, uri=None, id=None):
+        """Return the cached instance for the URI, or a new one, which is
+        initialized here and put in the cache. If another thread puts an
+        instance for the URI in the cache meanwhile, that one is returned.
+        """
         assert uri or id
         if not uri:
             uri = lims.get_uri(cls._URI, id)
+        key = lims._get_key(uri)
         try:
-            return lims.cache[uri]
+            return lims.cache[key]
         except KeyError:
-            return object.__new__(cls)
+            pass
+        self = object.__new__(cls)
+        uri = _intern(uri)
+        self.lims = lims
+        self._id = _intern(uri.split('?', 1)[0].rsplit('/', 1)[-1])
+        if lims.compact and cls._URI and \
+           uri == lims.get_uri(cls._URI, self._id):
+            self._uri = None            # Compact: recreate from the id.
+        else:
+            self._uri = uri
+        self._root = None
+        self._values = _UNLOADED
+        return lims.cache.setdefault(key, self)
 
     def __init__(self, lims, uri=None, id=None):
-        assert uri or id
-        if hasattr(self, 'lims'): return
-        if not uri:
-            uri = lims.get_uri(self._URI, id)
-        lims.cache[uri] = self
-        self.lims = lims
-        self._uri = uri
-        self.root = None
+        "The instance has been initialized by __new__."
+        pass
 
     def __str__(self):
         return "%s(%s)" % (self.__class__.__name__, self.id)
@@ -465,28 +597,121 @@ class Entity(object):
 
     @property
     def uri(self):
+        if self._uri is None:
+            return self.lims.get_uri(self._URI, self._id)
         return self._uri
 
+    @property
+    def root(self):
+        "The XML of this instance as an ElementTree; None if not loaded."
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        self._root = root
+        if root is None:
+            self._values = _UNLOADED
+        else:
+            self._values = dict()
+            self.lims.cache.loaded(self)
+            self.lims._share_root(self)
+
+    def get_nodes(self, tag):
+        """Return the list of the child elements of the XML root having
+        the tag, which must be that of a descriptor of the class.
+        Get the XML, if not loaded.
+        """
+        if self._root is None:
+            self.get()
+        nodes = self._values.get(_NODES)
+        if nodes is None:
+            nodes = self._values[_NODES] = self._extract_nodes()
+        return nodes.get(tag, ())
+
+    def _extract_nodes(self):
+        """Collect the child elements of the XML root for all descriptors
+        of the class in one pass. Return a dictionary keyed by tag.
+        """
+        tags = self._get_tags()
+        result = dict()
+        for node in self._root:
+            if node.tag in tags:
+                try:
+                    result[node.tag].append(node)
+                except KeyError:
+                    result[node.tag] = [node]
+        return result
+
+    @classmethod
+    def _get_tags(cls):
+        "Return the set of the tags of the descriptors of the class."
+        try:
+            return cls.__dict__['_tags']
+        except KeyError:
+            tags = set()
+            for klass in cls.__mro__:
+                for value in klass.__dict__.itervalues():
+                    if isinstance(value, TagDescriptor) and value.tag:
+                        tags.add(value.tag)
+            cls._tags = frozenset(tags)
+            return cls._tags
+
     @property
     def id(self):
         "Return the LIMS id; obtained from the URI."
-        parts = urlparse.urlsplit(self.uri)
-        return parts.path.split('/')[-1]
+        return self._id
 
     def get(self, force=False):
-        "Get the XML data for this instance."
-        if not force and self.root is not None: return
-        self.root = self.lims.get(self.uri)
+        """Get the XML data for this instance.
+        Forcing the get discards any unsaved modifications.
+        """
+        if not force:
+            if self._root is not None:
+                self.lims.cache.touch(self)
+                return
+            if self.lims._get_shared_root(self): return
+        others = self.lims._get_sharing(self)[1:]
+        root = self.lims.get(self.uri, revalidate=force)
+        for other in others:            # Their XML has the discarded edits.
+            self.lims._clear_dirty(other)
+            other.root = None
+        self.root = root
+        self.lims._clear_dirty(self)
+
+    def aget(self, force=False, callback=None):
+        """Get the XML data for this instance in a thread of the AsyncLims,
+        without blocking. Return an AsyncResult; its value is this instance.
+        Raise TypeError if the instance belongs to a plain Lims.
+        """
+        if not hasattr(self.lims, 'submit'):
+            raise TypeError('aget requires an AsyncLims instance')
+        def get():
+            self.get(force=force)
+            return self
+        return self.lims.submit(get, callback=callback)
 
     def put(self):
         "Save this instance by doing PUT of its serialized XML."
+        generation = self.lims._dirty.get(self, 0)
         data = self.lims.tostring(ElementTree.ElementTree(self.root))
         self.lims.put(self.uri, data)
+        self.lims._clear_dirty(self, generation)
+
+    def set_dirty(self):
+        "Mark this instance as modified, to be saved by Lims.flush."
+        self.lims._set_dirty(self)
+
+    @property
+    def is_dirty(self):
+        "Has this instance been modified since it was retrieved or saved?"
+        return self in self.lims._dirty
 
 
 class Lab(Entity):
     "Lab; container of researchers."
 
+    __slots__ = ()
+
     _URI = 'labs'
 
     name             = StringDescriptor('name')
@@ -501,6 +726,8 @@ class Lab(Entity):
 class Researcher(Entity):
     "Person; client scientist or lab personnel. Associated with a lab."
 
+    __slots__ = ()
+
     _URI = 'researchers'
 
     first_name  = StringDescriptor('first-name')
@@ -523,21 +750,40 @@ class Researcher(Entity):
 class Note(Entity):
     "Note attached to a project or a sample."
 
+    __slots__ = ()
+
     content = StringDescriptor(None)    # root element
 
 
 class File(Entity):
     "File attached to a project or a sample."
 
+    _URI = 'files'
+
+    __slots__ = ()
+
     attached_to       = StringDescriptor('attached-to')
     content_location  = StringDescriptor('content-location')
     original_location = StringDescriptor('original-location')
     is_published      = BooleanDescriptor('is-published')
 
+    def download(self, path, checksum=None, resume=True):
+        """Download the contents to the path, resuming a partial download.
+        Return the MD5 digest as a hex string."""
+        return self.lims.download_file(self, path, checksum=checksum,
+                                       resume=resume)
+
+    def upload(self, path, checksum=None):
+        """Upload the contents of the file at the path.
+        Return the MD5 digest as a hex string."""
+        return self.lims.upload_file(self, path, checksum=checksum)
+
 
 class Project(Entity):
     "Project concerning a number of samples; associated with a researcher."
 
+    __slots__ = ()
+
     _URI = 'projects'
 
     name          = StringDescriptor('name')
@@ -556,7 +802,10 @@ class Project(Entity):
 class Sample(Entity):
     "Customer's sample to be analyzed; associated with a project."
 
+    __slots__ = ()
+
     _URI = 'samples'
+    _BATCH = True
 
     name           = StringDescriptor('name')
     date_received  = StringDescriptor('date-received')
@@ -575,6 +824,8 @@ class Sample(Entity):
 class Containertype(Entity):
     "Type of container for analyte artifacts."
 
+    __slots__ = ()
+
     _TAG = 'container-type'
     _URI = 'containertypes'
 
@@ -588,7 +839,10 @@ class Containertype(Entity):
 class Container(Entity):
     "Container for analyte artifacts."
 
+    __slots__ = ()
+
     _URI = 'containers'
+    _BATCH = True
 
     name           = StringDescriptor('name')
     type           = EntityDescriptor('type', Containertype)
@@ -608,6 +862,8 @@ class Container(Entity):
 
 class Processtype(Entity):
 
+    __slots__ = ()
+
     _TAG = 'process-type'
     _URI = 'processtypes'
 
@@ -618,6 +874,8 @@ class Processtype(Entity):
 class Process(Entity):
     "Process (instance of Processtype) executed producing ouputs from inputs."
 
+    __slots__ = ()
+
     _URI = 'processes'
 
     type          = EntityDescriptor('type', Processtype)
@@ -635,7 +893,10 @@ class Process(Entity):
 class Artifact(Entity):
     "Any process input or output; analyte or file."
 
+    __slots__ = ()
+
     _URI = 'artifacts'
+    _BATCH = True
 
     name           = StringDescriptor('name')
     type           = StringDescriptor('type')
@@ -655,11 +916,10 @@ class Artifact(Entity):
 
     def get_state(self):
         "Parse out the state value from the URI."
-        parts = urlparse.urlparse(self.uri)
-        params = urlparse.parse_qs(parts.query)
-        try:
-            return params['state'][0]
-        except (KeyError, IndexError):
+        key = self.lims._get_key(self.uri)
+        if '?state=' in key:
+            return key.split('?state=', 1)[1]
+        else:
             return None
 
     # XXX set_state ?
@@ -0,0 +1,256 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Columnar export of entity attributes and UDFs for the LIMS interface.
+
+The columns are written as CSV, or as Parquet or Arrow files if pyarrow
+is installed.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import csv
+import datetime
+import collections
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from .entities import Entity, nsmap, _parse_date
+
+_UDF_TAG = nsmap('udf:field')
+
+
+def _numeric(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+def _boolean(value):
+    return value.lower() == 'true'
+
+_CONVERTERS = dict(numeric=_numeric, boolean=_boolean, date=_parse_date)
+
+
+class ColumnExport(object):
+    """Extraction of attribute values and top-level UDF values of entity
+    instances into columns, chunk by chunk. The type of a UDF column is
+    that of the first value found for it, and its converter is chosen
+    once for the column, rather than for each value. Entity values are
+    given as their URI.
+
+    The instances are loaded by batch, chunk by chunk. The XML of those
+    that were loaded for the export is released after the chunk has been
+    extracted. The instances themselves stay in the cache of the Lims
+    instance, unless its cache_policy is 'weak'; only then does memory
+    stay bounded for any number of instances, such as from iter_artifacts.
+
+    A field that is not an attribute of the class of an instance
+    raises AttributeError.
+    """
+
+    def __init__(self, lims, fields=(), udfs=(), chunk_size=None):
+        """fields: Names of attributes, such as 'name' or 'qc_flag'.
+        udfs: Names of UDFs.
+        chunk_size: Number of instances per chunk; default the batch size.
+        """
+        self.lims = lims
+        self.fields = list(fields)
+        self.udfs = list(udfs)
+        self.chunk_size = chunk_size or lims.batch_size
+        self.udf_types = collections.OrderedDict([(u, None) for u in udfs])
+        self._converters = dict()
+        self._classes = set()           # Those with the fields checked.
+
+    @property
+    def names(self):
+        "The column names; the fields followed by the UDFs."
+        return self.fields + self.udfs
+
+    def get_types(self):
+        """Return a dictionary of column name and value type: 'string',
+        'numeric', 'boolean' or 'date' for UDFs, and None for the fields
+        and the UDFs without any value so far."""
+        result = collections.OrderedDict([(f, None) for f in self.fields])
+        result.update(self.udf_types)
+        return result
+
+    def iter_chunks(self, instances):
+        """Yield a dictionary of column name and list of values
+        for each chunk of the instances."""
+        chunk = []
+        for instance in instances:
+            chunk.append(instance)
+            if len(chunk) >= self.chunk_size:
+                yield self.get_columns(chunk)
+                chunk = []
+        if chunk:
+            yield self.get_columns(chunk)
+
+    def get_columns(self, instances):
+        """Return a dictionary of column name and list of values
+        for the instances."""
+        release = [i for i in instances if i.root is None]
+        self.lims.load(instances)
+        result = collections.OrderedDict([(n, []) for n in self.names])
+        for instance in instances:
+            if instance.__class__ not in self._classes:
+                for field in self.fields:
+                    getattr(instance.__class__, field) # Check it exists.
+                self._classes.add(instance.__class__)
+            for field in self.fields:
+                result[field].append(_get_field(instance, field))
+            if self.udfs:
+                values = self._get_udfs(instance)
+                for udf in self.udfs:
+                    result[udf].append(values.get(udf))
+        for instance in release:
+            if not instance.is_dirty:
+                instance.root = None
+        return result
+
+    def _get_udfs(self, instance):
+        "Return a dictionary of the converted values of the wanted UDFs."
+        result = dict()
+        for elem in instance.root:
+            if elem.tag != _UDF_TAG: continue
+            name = elem.get('name')
+            if name not in self.udf_types: continue
+            value = elem.text
+            if not value: continue
+            try:
+                converter = self._converters[name]
+            except KeyError:
+                type = elem.get('type', 'string').lower()
+                self.udf_types[name] = type
+                converter = self._converters[name] = _CONVERTERS.get(type)
+            if converter is not None:
+                try:
+                    value = converter(value)
+                except ValueError:      # Inconsistent type; keep the text.
+                    pass
+            result[name] = value
+        return result
+
+
+def _get_field(instance, field):
+    "Return the value of the attribute, with entities given by URI."
+    try:
+        value = getattr(instance, field)
+    except AttributeError:              # No XML element for it.
+        return None
+    if isinstance(value, Entity):
+        return value.uri
+    if isinstance(value, (list, tuple)):
+        return ' '.join([_to_unicode(getattr(v, 'uri', v)) or u''
+                         for v in value])
+    return value
+
+
+def to_columns(lims, instances, fields=(), udfs=()):
+    "Return a dictionary of column name and list of values for the instances."
+    export = ColumnExport(lims, fields=fields, udfs=udfs)
+    result = collections.OrderedDict([(n, []) for n in export.names])
+    for columns in export.iter_chunks(instances):
+        for name, values in columns.iteritems():
+            result[name].extend(values)
+    return result
+
+def write_csv(outfile, lims, instances, fields=(), udfs=(), chunk_size=None):
+    """Write the columns for the instances as CSV to the open file,
+    with a header row. Return the number of rows written."""
+    export = ColumnExport(lims, fields=fields, udfs=udfs,
+                          chunk_size=chunk_size)
+    writer = csv.writer(outfile)
+    writer.writerow([_encode(n) for n in export.names])
+    count = 0
+    for columns in export.iter_chunks(instances):
+        for row in zip(*columns.values()):
+            writer.writerow([_encode(v) for v in row])
+            count += 1
+    return count
+
+def _encode(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+_ARROW_TYPES = dict(numeric=('float64', (int, long, float)),
+                    boolean=('bool_', bool),
+                    date=('date32', datetime.date))
+
+def _get_arrow_table(columns, types):
+    """Return a pyarrow Table of the columns, typed as given. Values not of
+    the type of their column, which may occur for inconsistently typed
+    UDFs, are given as null."""
+    arrays = []
+    for name, values in columns.iteritems():
+        try:
+            type, classes = _ARROW_TYPES[types.get(name)]
+        except KeyError:
+            type = pyarrow.string()
+            values = [_to_unicode(v) for v in values]
+        else:
+            type = getattr(pyarrow, type)()
+            values = [_check_type(v, classes) for v in values]
+        arrays.append(pyarrow.array(values, type=type))
+    return pyarrow.Table.from_arrays(arrays, names=list(columns.keys()))
+
+def _check_type(value, classes):
+    if isinstance(value, classes):
+        return value
+    return None
+
+def _to_unicode(value):
+    if value is None or isinstance(value, unicode):
+        return value
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+def _write_tables(open_writer, lims, instances, fields, udfs, chunk_size):
+    """Write the chunks of columns as tables by the writer given by the
+    function called with the schema of the first chunk. The types of UDFs
+    without values in the first chunk are then fixed as string."""
+    if pyarrow is None:
+        raise ImportError('pyarrow is required for Parquet and Arrow output')
+    export = ColumnExport(lims, fields=fields, udfs=udfs,
+                          chunk_size=chunk_size)
+    writer = None
+    types = None
+    count = 0
+    try:
+        for columns in export.iter_chunks(instances):
+            if types is None:
+                types = export.get_types()
+            table = _get_arrow_table(columns, types)
+            if writer is None:
+                writer = open_writer(table.schema)
+            writer.write_table(table)
+            count += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+def write_parquet(filename, lims, instances, fields=(), udfs=(),
+                  chunk_size=None):
+    """Write the columns for the instances to a Parquet file, one row group
+    per chunk. Requires pyarrow. Return the number of rows written."""
+    return _write_tables(
+        lambda schema: pyarrow.parquet.ParquetWriter(filename, schema),
+        lims, instances, fields, udfs, chunk_size)
+
+def write_arrow(filename, lims, instances, fields=(), udfs=(),
+                chunk_size=None):
+    """Write the columns for the instances to an Arrow IPC file, one record
+    batch per chunk. Requires pyarrow. Return the number of rows written."""
+    return _write_tables(
+        lambda schema: pyarrow.RecordBatchFileWriter(filename, schema),
+        lims, instances, fields, udfs, chunk_size)
@@ -0,0 +1,177 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+On-disk cache of HTTP responses for the LIMS interface.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import os
+import time
+import json
+import errno
+import urllib
+import hashlib
+import urlparse
+import tempfile
+
+
+class ResponseCache(object):
+    """Cache of the XML of GET responses in files in a directory,
+    keyed by canonical URI, including the query.
+
+    The ETag and Last-Modified headers of a response are stored with it,
+    and a cached response is revalidated by a conditional GET. Within the
+    time-to-live, if any, given for the resource (i.e. entity class), the
+    cached response is used without revalidation.
+
+    Files are written atomically by rename, so that several processes may
+    share a cache directory. The least recently used files are removed
+    when the total size exceeds 'max_bytes'.
+    """
+
+    def __init__(self, directory, max_bytes=100*1024*1024, ttl=dict()):
+        """directory: The directory for the cache files; created if needed.
+        max_bytes: The max total size of the cache files.
+        ttl: Dictionary with entity class (or its URI segment, such as
+             'projects') as key, and time-to-live in seconds as value.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = dict()
+        for key, value in ttl.iteritems():
+            if not isinstance(key, basestring):
+                key = key._URI
+            self.ttl[key] = value
+        try:
+            os.makedirs(directory)
+        except OSError, error:
+            if error.errno != errno.EEXIST: raise
+        self._written = 0
+        self.evict()
+
+    def get_key(self, uri, params=dict()):
+        """Return the canonical form of the URI and the query params:
+        lower-case scheme and host, no default port, no trailing slash,
+        and sorted query.
+        """
+        parts = urlparse.urlsplit(uri)
+        scheme = parts.scheme.lower()
+        netloc = parts.netloc.lower()
+        if (scheme, netloc.rsplit(':', 1)[-1]) in (('http', '80'),
+                                                   ('https', '443')):
+            netloc = netloc.rsplit(':', 1)[0]
+        query = urlparse.parse_qsl(parts.query, True)
+        for key, value in params.iteritems():
+            if isinstance(value, (list, tuple)):
+                query.extend([(key, v) for v in value])
+            else:
+                query.append((key, value))
+        query = urllib.urlencode(sorted([(str(k), unicode(v).encode('utf-8'))
+                                         for k, v in query]))
+        return urlparse.urlunsplit((scheme, netloc, parts.path.rstrip('/'),
+                                    query, ''))
+
+    def get_filename(self, uri, params=dict()):
+        "Return the name of the cache file for the URI and query params."
+        key = self.get_key(uri, params)
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.directory,
+                            hashlib.sha1(key).hexdigest() + '.xml')
+
+    def get_ttl(self, uri):
+        """Return the time-to-live for the resource of the URI, or None.
+        Only the URI of an entity, a segment and an id, has a time-to-live;
+        lists of entities are always revalidated."""
+        segments = urlparse.urlsplit(uri).path.strip('/').split('/')
+        try:
+            segments = segments[segments.index('api') + 2:]
+        except ValueError:
+            return None
+        if len(segments) != 2: return None
+        return self.ttl.get(segments[0])
+
+    def lookup(self, uri, params=dict()):
+        """Return the cache entry for the URI and query params, or None.
+        The entry is a dictionary with the items 'content', 'etag',
+        'last_modified' and 'stored', the time of the last validation.
+        """
+        filename = self.get_filename(uri, params)
+        try:
+            with open(filename, 'rb') as infile:
+                entry = json.loads(infile.readline())
+                entry['content'] = infile.read()
+        except (IOError, ValueError):
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return entry
+
+    def is_fresh(self, uri, entry):
+        "Is the entry within the time-to-live for its resource?"
+        ttl = self.get_ttl(uri)
+        if ttl is None: return False
+        return time.time() - entry['stored'] < ttl
+
+    def store(self, uri, params, response):
+        "Store the content and validators of the response."
+        entry = dict(etag=response.headers.get('etag'),
+                     last_modified=response.headers.get('last-modified'))
+        self._write(self.get_filename(uri, params), entry, response.content)
+
+    def refresh(self, uri, params, entry):
+        "Record that the entry has been revalidated by the server."
+        content = entry.pop('content')
+        self._write(self.get_filename(uri, params), entry, content)
+
+    def invalidate(self, uri, params=dict()):
+        "Remove the cache entry for the URI and query params, if any."
+        try:
+            os.remove(self.get_filename(uri, params))
+        except OSError:
+            pass
+
+    def _write(self, filename, entry, content):
+        entry['stored'] = time.time()
+        fd, tmpname = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(json.dumps(entry) + '\n')
+            outfile.write(content)
+        os.rename(tmpname, filename)
+        self._written += len(content)
+        if self._written > self.max_bytes / 10:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used cache files, until the total
+        size is below 90% of the max."""
+        self._written = 0
+        files = []
+        total = 0
+        for name in os.listdir(self.directory):
+            filename = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            if name.endswith('.tmp'):   # Left by a dead process?
+                if stat.st_mtime < time.time() - 3600:
+                    self._remove(filename)
+                continue
+            files.append((stat.st_mtime, stat.st_size, filename))
+            total += stat.st_size
+        if total <= self.max_bytes: return
+        files.sort()
+        for mtime, size, filename in files:
+            if total <= 0.9 * self.max_bytes: break
+            self._remove(filename)
+            total -= size
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
@@ -0,0 +1,169 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Dense well grids of containers for the LIMS interface.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import string
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Layout(object):
+    """The wells of a container as a dense grid, indexed by (row, column)
+    from 0, where the row is given by the y dimension of the container type,
+    and the column by the x dimension. Each item of 'grid' is the artifact
+    placed in the well, or None. The boolean grids 'unavailable' and
+    'calibrant' mark the unavailable and calibrant wells.
+    A well may also be given by its location name, such as 'A:1'.
+    """
+
+    def __init__(self, container, containertype, placements):
+        """container: The Container instance.
+        containertype: Its Containertype instance, which must be loaded.
+        placements: Dictionary of location names and artifacts.
+        """
+        self.container = container
+        self.type = containertype
+        self.y_dimension = containertype.y_dimension
+        self.x_dimension = containertype.x_dimension
+        self.shape = (self.y_dimension['size'], self.x_dimension['size'])
+        rows, columns = self.shape
+        self.grid = [[None] * columns for i in xrange(rows)]
+        for name, artifact in placements.iteritems():
+            row, column = self.get_index(name)
+            self.grid[row][column] = artifact
+        self.unavailable = self._get_mask(containertype.unavailable_wells)
+        self.calibrant = self._get_mask(containertype.calibrant_wells)
+
+    def __repr__(self):
+        return "Layout(%s, %dx%d)" % (self.container.id,
+                                      self.shape[0], self.shape[1])
+
+    def __getitem__(self, index):
+        """Return the artifact in the well given by (row, column) or name,
+        or the list of artifacts in the row given by its index."""
+        if isinstance(index, (int, long)):
+            return self.grid[index]
+        row, column = self._get_index(index)
+        return self.grid[row][column]
+
+    def __iter__(self):
+        "Iterate over the rows of the grid."
+        return iter(self.grid)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def get_index(self, name):
+        "Return the tuple (row, column) of the location name, e.g. 'A:1'."
+        try:
+            row, column = name.split(':')
+            row = _get_position(row, self.y_dimension)
+            column = _get_position(column, self.x_dimension)
+        except ValueError:
+            raise KeyError("invalid well '%s'" % name)
+        if not (0 <= row < self.shape[0] and 0 <= column < self.shape[1]):
+            raise KeyError("well '%s' outside container" % name)
+        return row, column
+
+    def get_name(self, row, column):
+        "Return the location name, e.g. 'A:1', of the (row, column)."
+        return "%s:%s" % (_get_label(row, self.y_dimension),
+                          _get_label(column, self.x_dimension))
+
+    def _get_index(self, index):
+        if isinstance(index, basestring):
+            return self.get_index(index)
+        return index
+
+    def _get_mask(self, names):
+        rows, columns = self.shape
+        result = [[False] * columns for i in xrange(rows)]
+        for name in names:
+            try:
+                row, column = self.get_index(name)
+            except KeyError:
+                continue
+            result[row][column] = True
+        return result
+
+    @property
+    def occupied(self):
+        "Boolean grid of the wells having an artifact."
+        return [[artifact is not None for artifact in row]
+                for row in self.grid]
+
+    def wells(self):
+        "Return a list of tuples (name, artifact) of the occupied wells."
+        result = []
+        for i, row in enumerate(self.grid):
+            for j, artifact in enumerate(row):
+                if artifact is not None:
+                    result.append((self.get_name(i, j), artifact))
+        return result
+
+    def map(self, function, default=None):
+        """Return a grid of the values of the function for the artifact
+        in each occupied well, and the default for the empty wells.
+        For example: layout.map(lambda a: a.qc_flag)
+        """
+        result = []
+        for row in self.grid:
+            values = []
+            for artifact in row:
+                if artifact is None:
+                    values.append(default)
+                else:
+                    values.append(function(artifact))
+            result.append(values)
+        return result
+
+    def to_array(self, grid=None, dtype=None):
+        """Return the grid as a 2D numpy array; by default the artifacts,
+        otherwise the given grid, such as 'occupied' or a result of 'map'.
+        Requires numpy.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for Layout.to_array')
+        if grid is None:
+            grid = self.grid
+            dtype = object
+        if dtype is object:             # Do not let numpy nest sequences.
+            result = numpy.empty(self.shape, dtype=object)
+            for i, row in enumerate(grid):
+                for j, value in enumerate(row):
+                    result[i, j] = value
+            return result
+        return numpy.array(grid, dtype=dtype)
+
+
+def _get_position(label, dimension):
+    "Return the 0-based position of the label in the dimension."
+    if dimension['is_alpha']:
+        label = label.strip().upper()
+        position = 0
+        for char in label:
+            if char not in string.ascii_uppercase:
+                raise ValueError("invalid label '%s'" % label)
+            position = position * 26 + ord(char) - ord('A') + 1
+        return position - 1 - dimension['offset']
+    else:
+        return int(label) - dimension['offset']
+
+def _get_label(position, dimension):
+    "Return the label of the 0-based position in the dimension."
+    position += dimension['offset']
+    if not dimension['is_alpha']:
+        return str(position)
+    label = ''
+    position += 1
+    while position > 0:
+        position, remainder = divmod(position - 1, 26)
+        label = string.ascii_uppercase[remainder] + label
+    return label
@@ -8,33 +8,128 @@ Copyright (C) 2012 Per Kraulis
 
 __all__ = ['Lab', 'Researcher', 'Project', 'Sample',
            'Containertype', 'Container', 'Processtype', 'Process',
-           'Artifact', 'Lims']
+           'Artifact', 'File', 'Lims']
 
+import re
+import copy
+import time
 import urllib
-from cStringIO import StringIO
+import inspect
+import warnings
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
 
 # http://docs.python-requests.org/
 import requests
 
 from .entities import *
+from .cache import EntityCache
+from .layout import Layout
+from .planner import QueryPlan
+from . import xmlbackend
+from . import export
+from . import metrics
+from . import transfer
 
 
 class Lims(object):
     "LIMS interface through which all entity instances are retrieved."
 
     VERSION = 'v1'
+    MAX_URL_LENGTH = 4000               # Longer list queries are split.
+    BISECT_STATUSES = (400, 404)        # A failed chunk with these is split.
 
-    def __init__(self, baseuri, username, password):
+    def __init__(self, baseuri, username, password,
+                 pool_size=10, keep_alive=True, max_retries=0, timeout=None,
+                 workers=4, prefetch_pages=1, batch_size=500,
+                 cache_policy='unbounded', cache_size=10000,
+                 response_cache=None, compact=False, transport=None):
         """baseuri: Base URI for the GenoLogics server, excluding
                     the 'api' or version parts!
                     For example: https://genologics.scilifelab.se:8443/
         username: The account name of the user to login as.
         password: The password for the user account to login as.
+        pool_size: Max number of persistent connections kept to the server.
+        keep_alive: If False, close the connection after each request.
+        max_retries: Number of retries on failed connection attempts.
+        timeout: Seconds to wait for the server; a (connect, read)
+                 tuple, or None for no timeout.
+        workers: Number of threads for requests done concurrently.
+        prefetch_pages: Number of list pages to request ahead of the page
+                        being consumed; 0 to get the pages strictly serially.
+        batch_size: Max number of instances in one batch request.
+        cache_policy: How the cache of instances holds on to them:
+                      'unbounded', 'weak' or 'lru'. See EntityCache.
+        cache_size: Max number of instances having their XML in memory,
+                    for the 'lru' policy.
+        response_cache: Optional ResponseCache instance, for keeping
+                        the XML of GET responses on disk between runs.
+        compact: If True, instances whose URI can be recreated from their
+                 LIMS id do not store it, to save memory.
+        transport: Optional TransportPolicy instance, for retries with
+                   backoff, rate limiting and adaptive concurrency.
         """
         self.baseuri = baseuri.rstrip('/') + '/'
         self.username = username
         self.password = password
-        self.cache = dict()
+        self.timeout = timeout
+        self.workers = workers
+        self.prefetch_pages = prefetch_pages
+        self.batch_size = batch_size
+        self.cache = EntityCache(policy=cache_policy, size=cache_size)
+        self._dirty = collections.OrderedDict() # Instance -> generation.
+        self._dirty_lock = threading.Lock()
+        self._generation = 0
+        self.response_cache = response_cache
+        self.compact = compact
+        self.transport = transport
+        self.metrics = metrics.Metrics()
+        self.listeners = [self.metrics]
+        self._apiuri = self.get_uri('')
+        self._apibase = _canonical_uri(self._apiuri)[0] + '/'
+        self.session = requests.Session()
+        self.session.auth = (username, password)
+        self.session.headers['accept'] = 'application/xml'
+        if not keep_alive:
+            self.session.headers['connection'] = 'close'
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size,
+                                                max_retries=max_retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        """Close the connections in the pool of the HTTP session,
+        and stop the threads for concurrent requests.
+        """
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+        self.session.close()
+
+    def cache_info(self):
+        """Return a dictionary of statistics for the cache of instances:
+        hits, misses, evictions and estimated resident bytes of the XML.
+        """
+        return self.cache.info()
+
+    def _get_pool(self):
+        """Return the pool of threads for concurrent requests. A task in it
+        must not wait for other tasks in it, lest all threads wait."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPool(self.workers)
+            return self._pool
 
     def get_uri(self, *segments, **query):
         "Return the full URI given the path segments and optional query."
@@ -44,39 +139,156 @@ class Lims(object):
             url += '?' + urllib.urlencode(query)
         return url
 
-    def get(self, uri, params=dict()):
-        "GET data from the URI. Return the response XML as an ElementTree."
-        r = requests.get(uri, params=params,
-                         auth=(self.username, self.password),
-                         headers=dict(accept='application/xml'))
-        return self.parse_response(r)
+    def _get_key(self, uri):
+        """Return the key for the instance cache given the URI: the URI in
+        canonical form (lower-case scheme and host, no default port, no
+        trailing slash), relative to the API base. The artifact state,
+        if any, is kept as the only query parameter, '?state=...'.
+        """
+        key = None
+        if uri.startswith(self._apiuri):   # Fast paths; already canonical.
+            path, sep, query = uri[len(self._apiuri):].partition('?')
+            if path[-1:] not in ('/', '') and '//' not in path:
+                if not sep:
+                    key = path
+                elif query[:6] == 'state=' and query[6:].isdigit():
+                    key = path + '?' + query  # As in the XML of an artifact.
+        if key is None:
+            key, state = _canonical_uri(uri)
+            if key.startswith(self._apibase):
+                key = key[len(self._apibase):]
+            if state is not None:
+                key = "%s?state=%s" % (key, state)
+        if type(key) is str:
+            key = intern(key)
+        return key
+
+    def _share_root(self, instance):
+        """Give the XML of the instance, which has been loaded using a URI
+        without state, to the cached instance for the same artifact in the
+        current state, if that is not loaded.
+        """
+        uri = instance._root.get('uri')
+        if not uri or '?' not in uri or uri == instance._uri: return
+        key = self._get_key(uri)
+        if key == self._get_key(instance.uri): return
+        other = self.cache.get(key)
+        if other is not None and other._root is None:
+            self._use_root(other, instance)
+
+    def _get_shared_root(self, instance):
+        """Give the instance the XML of the cached instance for the same
+        artifact without state, if it has been loaded and is in the state
+        of the given instance. Return True if so, otherwise False.
+        """
+        key = self._get_key(instance.uri)
+        if '?' not in key: return False
+        other = self.cache.get(key.split('?', 1)[0])
+        if other is None or other._root is None: return False
+        if self._get_key(other._root.get('uri', '')) != key: return False
+        self._use_root(instance, other)
+        return True
+
+    def _use_root(self, instance, other):
+        """Let the instance share the XML of the other instance, for the same
+        artifact, and its memo of attribute values, so that a modification
+        through either is seen by both. It is modified if the other is.
+        """
+        instance._root = other._root
+        instance._values = other._values
+        self.cache.loaded(instance)
+        with self._dirty_lock:
+            generation = self._dirty.get(other)
+            if generation is not None:
+                self._dirty[instance] = generation
+
+    def _get_sharing(self, instance):
+        """Return the list of the cached instances sharing the XML of the
+        instance, including it: those for the same artifact with and
+        without state.
+        """
+        root = instance._root
+        if root is None: return [instance]
+        key = self._get_key(instance.uri)
+        uri = root.get('uri')
+        if '?' not in key and (not uri or '?' not in uri): return [instance]
+        keys = set([key.split('?', 1)[0]])
+        if uri:
+            keys.add(self._get_key(uri))
+        keys.discard(key)
+        result = [instance]
+        for key in keys:
+            other = self.cache.get(key)
+            if other is not None and other._root is root:
+                result.append(other)
+        return result
+
+    def get(self, uri, params=dict(), revalidate=False):
+        """GET data from the URI. Return the response XML as an ElementTree.
+        If there is a response cache, a cached response is used if it is
+        within its time-to-live (unless 'revalidate' is True), or if the
+        server says it is not modified.
+        """
+        if self.response_cache is None:
+            r = self._request('GET', uri, params=params)
+            return self.parse_response(r)
+        entry = self.response_cache.lookup(uri, params)
+        headers = dict()
+        if entry is not None:
+            if not revalidate and self.response_cache.is_fresh(uri, entry):
+                return ElementTree.fromstring(entry['content'])
+            if entry.get('etag'):
+                headers['if-none-match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['if-modified-since'] = entry['last_modified']
+        r = self._request('GET', uri, params=params, headers=headers)
+        if r.status_code == 304 and entry is not None:
+            root = ElementTree.fromstring(entry['content'])
+            self.response_cache.refresh(uri, params, entry)
+            return root
+        root = self.parse_response(r)
+        self.response_cache.store(uri, params, r)
+        return root
 
     def put(self, uri, data, params=dict()):
         """PUT the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.put(uri, data=data, params=params,
-                         auth=(self.username, self.password),
-                         headers={'content-type':'application/xml',
-                                  'accept': 'application/xml'})
+        self._invalidate(uri)
+        r = self._request('PUT', uri, data=data, params=params,
+                          headers={'content-type': 'application/xml'})
         return self.parse_response(r)
 
     def post(self, uri, data, params=dict()):
         """POST the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.post(uri, data=data, params=params,
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
+        self._invalidate(uri)
+        r = self._request('POST', uri, data=data, params=params,
+                          headers={'content-type': 'application/xml'})
         return self.parse_response(r)
 
+    def _invalidate(self, uri):
+        """Remove any cached responses for the URI. For an artifact, those
+        for its URI without state, and with the state of the cached
+        instances, are also removed, since they give the same XML.
+        """
+        if self.response_cache is None: return
+        base = uri.split('?', 1)[0]
+        uris = set([uri, base])
+        for key in (self._get_key(uri), self._get_key(base)):
+            instance = self.cache.get(key)
+            if instance is not None and instance._root is not None:
+                uris.add(instance._root.get('uri') or base)
+        for uri in uris:
+            self.response_cache.invalidate(uri)
+
     def check_version(self):
         """Raise ValueError if the version for this interface
         does not match any of the versions given for the API.
         """
         uri = urlparse.urljoin(self.baseuri, 'api')
-        r = requests.get(uri, auth=(self.username, self.password))
+        r = self._request('GET', uri)
         root = self.parse_response(r)
         tag = nsmap('ver:versions')
         assert tag == root.tag
@@ -84,6 +296,84 @@ class Lims(object):
             if node.attrib['major'] == self.VERSION: return
         raise ValueError('version mismatch')
 
+    def _request(self, method, uri, idempotent=None, **kwargs):
+        """Send the request through the pooled session, according to the
+        transport policy, if any. 'idempotent' tells whether the request may
+        be retried; by default only for idempotent methods, not POST.
+        An event for the request is given to the listeners.
+        Return the response.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        info = dict(retries=0)
+        started = time.time()
+        try:
+            if self.transport is None:
+                response = self.session.request(method, uri, **kwargs)
+            else:
+                response = self.transport.send(self.session.request,
+                                               method, uri,
+                                               idempotent=idempotent,
+                                               info=info, **kwargs)
+        except Exception, error:
+            self._emit(method, uri, kwargs, started, None, error, info)
+            raise
+        self._emit(method, uri, kwargs, started, response, None, info)
+        return response
+
+    def _emit(self, method, uri, kwargs, started, response, error, info):
+        "Give the event for the request to the listeners."
+        if not self.listeners: return
+        key = self._get_key(uri)
+        if '://' in key:
+            klass = None
+        else:
+            klass = _get_classes().get(key.split('/', 1)[0])
+        data = kwargs.get('data')
+        received = None
+        if response is not None:
+            if kwargs.get('stream'):
+                length = response.headers.get('content-length')
+                if length:
+                    received = int(length)
+            else:
+                received = len(response.content)
+        event = dict(method=method,
+                     endpoint=metrics.get_endpoint(key),
+                     entity=klass and klass.__name__ or None,
+                     status=getattr(response, 'status_code', None),
+                     error=error,
+                     latency=time.time() - started,
+                     bytes_sent=data and len(data) or 0,
+                     bytes_received=received,
+                     retries=info['retries'])
+        for listener in self.listeners:
+            listener(event)
+
+    def add_listener(self, listener):
+        """Add a function to be called with the event for each request.
+        See the module 'metrics'."""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def stats(self):
+        """Return a dictionary with the aggregate statistics of the requests
+        per method and endpoint ('requests'; see metrics.Metrics), and of
+        the cache of instances ('cache'), including the hit ratio.
+        """
+        cache = dict(policy=self.cache.policy,
+                     instances=len(self.cache),
+                     hits=self.cache.hits,
+                     misses=self.cache.misses,
+                     evictions=self.cache.evictions)
+        lookups = cache['hits'] + cache['misses']
+        if lookups:
+            cache['hit_ratio'] = float(cache['hits']) / lookups
+        else:
+            cache['hit_ratio'] = None
+        return dict(requests=self.metrics.get_stats(), cache=cache)
+
     def parse_response(self, response):
         """Parse the XML returned in the response.
         Raise an HTTP error if the response status is not 200.
@@ -97,9 +387,34 @@ class Lims(object):
             node = root.find('suggested-actions')
             if node is not None:
                 message += ' ' + node.text
-            raise requests.exceptions.HTTPError(message)
+            raise requests.exceptions.HTTPError(message, response=response)
         return root
 
+    def parse_elements(self, response):
+        """Parse the XML returned in the response incrementally, from the
+        response stream. Yield each element directly below the root as soon
+        as it is complete; it is then removed from the root to free memory.
+        Raise an HTTP error if the response status is not 200.
+        """
+        try:
+            if response.status_code != 200:
+                self.parse_response(response)
+            response.raw.decode_content = True
+            depth = 0
+            for event, elem in ElementTree.iterparse(response.raw,
+                                                     events=('start', 'end')):
+                if event == 'start':
+                    if depth == 0:
+                        root = elem
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 1:
+                        yield elem
+                        root.remove(elem)
+        finally:
+            response.close()
+
     def get_labs(self, name=None, last_modified=None,
                  udf=dict(), udtname=None, udt=dict(), start_index=None):
         """Get a list of labs, filtered by keyword arguments.
@@ -238,13 +553,15 @@ class Lims(object):
         return self._get_instances(Container, params=params)
 
     def get_processes(self, last_modified=None, type=None,
-                      inputartifactslimsid=None,
+                      inputartifactlimsid=None,
                       techfirstname=None, techlastname=None, projectname=None,
-                      udf=dict(), udtname=None, udt=dict(), start_index=None):
+                      udf=dict(), udtname=None, udt=dict(), start_index=None,
+                      inputartifactslimsid=None):
         """Get a list of processes, filtered by keyword arguments.
         last_modified: Since the given ISO format datetime.
         type: Process type, or list of types.
-        inputartifactslimsid: Input artifact LIMS id, or list of.
+        inputartifactlimsid: Input artifact LIMS id, or list of.
+        inputartifactslimsid: Deprecated alias of inputartifactlimsid.
         udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
         udtname: UDT name, or list of names.
         udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
@@ -256,6 +573,7 @@ class Lims(object):
         """
         params = self._get_params(last_modified=last_modified,
                                   type=type,
+                                  inputartifactlimsid=inputartifactlimsid,
                                   inputartifactslimsid=inputartifactslimsid,
                                   techfirstname=techfirstname,
                                   techlastname=techlastname,
@@ -264,8 +582,116 @@ class Lims(object):
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
         return self._get_instances(Process, params=params)
 
+    def iter_labs(self, **kwargs):
+        """Iterate over labs, fetching them page by page.
+        Takes the same filters as get_labs.
+        """
+        params = self._get_query_params(self.get_labs, kwargs)
+        return self._iter_instances(Lab, params=params)
+
+    def iter_researchers(self, **kwargs):
+        """Iterate over researchers, fetching them page by page.
+        Takes the same filters as get_researchers.
+        """
+        params = self._get_query_params(self.get_researchers, kwargs)
+        return self._iter_instances(Researcher, params=params)
+
+    def iter_projects(self, **kwargs):
+        """Iterate over projects, fetching them page by page.
+        Takes the same filters as get_projects.
+        """
+        params = self._get_query_params(self.get_projects, kwargs)
+        return self._iter_instances(Project, params=params)
+
+    def iter_samples(self, **kwargs):
+        """Iterate over samples, fetching them page by page.
+        Takes the same filters as get_samples.
+        """
+        params = self._get_query_params(self.get_samples, kwargs)
+        return self._iter_instances(Sample, params=params)
+
+    def iter_artifacts(self, **kwargs):
+        """Iterate over artifacts, fetching them page by page.
+        Takes the same filters as get_artifacts.
+        """
+        params = self._get_query_params(self.get_artifacts, kwargs)
+        return self._iter_instances(Artifact, params=params)
+
+    def iter_containers(self, **kwargs):
+        """Iterate over containers, fetching them page by page.
+        Takes the same filters as get_containers.
+        """
+        params = self._get_query_params(self.get_containers, kwargs)
+        return self._iter_instances(Container, params=params)
+
+    def iter_processes(self, **kwargs):
+        """Iterate over processes, fetching them page by page.
+        Takes the same filters as get_processes.
+        """
+        params = self._get_query_params(self.get_processes, kwargs)
+        return self._iter_instances(Process, params=params)
+
+    def count_labs(self, **kwargs):
+        """Count the labs by streaming the pages, without creating
+        instances. Takes the same filters as get_labs.
+        """
+        params = self._get_query_params(self.get_labs, kwargs)
+        return self._count_instances(Lab, params=params)
+
+    def count_researchers(self, **kwargs):
+        """Count the researchers by streaming the pages, without creating
+        instances. Takes the same filters as get_researchers.
+        """
+        params = self._get_query_params(self.get_researchers, kwargs)
+        return self._count_instances(Researcher, params=params)
+
+    def count_projects(self, **kwargs):
+        """Count the projects by streaming the pages, without creating
+        instances. Takes the same filters as get_projects.
+        """
+        params = self._get_query_params(self.get_projects, kwargs)
+        return self._count_instances(Project, params=params)
+
+    def count_samples(self, **kwargs):
+        """Count the samples by streaming the pages, without creating
+        instances. Takes the same filters as get_samples.
+        """
+        params = self._get_query_params(self.get_samples, kwargs)
+        return self._count_instances(Sample, params=params)
+
+    def count_artifacts(self, **kwargs):
+        """Count the artifacts by streaming the pages, without creating
+        instances. Takes the same filters as get_artifacts.
+        """
+        params = self._get_query_params(self.get_artifacts, kwargs)
+        return self._count_instances(Artifact, params=params)
+
+    def count_containers(self, **kwargs):
+        """Count the containers by streaming the pages, without creating
+        instances. Takes the same filters as get_containers.
+        """
+        params = self._get_query_params(self.get_containers, kwargs)
+        return self._count_instances(Container, params=params)
+
+    def count_processes(self, **kwargs):
+        """Count the processes by streaming the pages, without creating
+        instances. Takes the same filters as get_processes.
+        """
+        params = self._get_query_params(self.get_processes, kwargs)
+        return self._count_instances(Process, params=params)
+
     def _get_params(self, **kwargs):
-        "Convert keyword arguments to a kwargs dictionary."
+        """Convert keyword arguments to a kwargs dictionary.
+        A deprecated name of an argument is replaced by the current one.
+        """
+        for old, new in _RENAMED_PARAMS.iteritems():
+            value = kwargs.pop(old, None)
+            if value is None: continue
+            warnings.warn("'%s' is deprecated; use '%s'" % (old, new),
+                          DeprecationWarning, stacklevel=3)
+            if kwargs.get(new) is not None:
+                raise TypeError("both '%s' and '%s' given" % (old, new))
+            kwargs[new] = value
         result = dict()
         for key, value in kwargs.iteritems():
             if value is None: continue
@@ -283,45 +709,673 @@ class Lims(object):
             result["udt.%s" % key] = value
         return result
 
+    def _get_query_params(self, method, kwargs):
+        """Convert the keyword arguments for the given get_* method
+        to a params dictionary.
+        """
+        names = inspect.getargspec(method).args
+        for key in kwargs:
+            if key not in names:
+                raise TypeError("%s() got an unexpected keyword argument '%s'"
+                                % (method.__name__, key))
+        kwargs = kwargs.copy()
+        udf = kwargs.pop('udf', dict())
+        udtname = kwargs.pop('udtname', None)
+        udt = kwargs.pop('udt', dict())
+        params = self._get_params(**kwargs)
+        params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
+        return params
+
     def _get_instances(self, klass, params=dict()):
-        result = []
+        return list(self._iter_instances(klass, params=params))
+
+    def _iter_instances(self, klass, params=dict()):
+        "Yield the instances in the list given by the query, page by page."
+        for uris in self._iter_pages(klass, params=params):
+            for uri in uris:
+                yield klass(self, uri=uri)
+
+    def _count_instances(self, klass, params=dict()):
+        "Return the number of items in the list given by the query."
+        count = 0
+        for uris in self._iter_pages(klass, params=params):
+            count += len(uris)
+        return count
+
+    def _iter_pages(self, klass, params=dict()):
+        """Yield the list of item URIs for each page of the list given
+        by the query. Only the page given by 'start-index' if it is in
+        the params. The next pages are requested in the thread pool while
+        the current page is consumed. When the server's page stride is
+        known from the 'start-index' of the next-page link, up to
+        'prefetch_pages' pages ahead are requested in parallel.
+        """
         tag = klass._TAG
         if tag is None:
             tag = klass.__name__.lower()
-        root = self.get(self.get_uri(klass._URI), params=params)
-        while params.get('start-index') is None: # Loop over all pages.
-            for node in root.findall(tag):
-                result.append(klass(self, uri=node.attrib['uri']))
-            node = root.find('next-page')
-            if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
+        uri = self.get_uri(klass._URI)
+        if params.get('start-index') is None:
+            plan = QueryPlan(uri, params, self.MAX_URL_LENGTH)
+            if len(plan) > 1:
+                for uris in self._iter_plan(plan, tag):
+                    yield uris
+                return
+        uris, next = self._get_page(uri, params, tag)
+        if params.get('start-index') is not None or next is None:
+            yield uris
+            return
+        if self.prefetch_pages < 1:
+            yield uris
+            while next is not None:     # The next-page URI has the query.
+                uris, next = self._get_page(next, dict(), tag)
+                yield uris
+            return
+        pool = self._get_pool()
+        pending = collections.deque()
+        def submit(uri):
+            result = pool.apply_async(self._get_page, (uri, dict(), tag))
+            pending.append((_get_start_index(uri), uri, result))
+        stride = _get_start_index(next)
+        last = None
+        while True:
+            if next is None:            # Last page; drop any speculative.
+                pending.clear()
+            else:
+                if not pending or pending[0][0] != _get_start_index(next):
+                    pending.clear()
+                    submit(next)
+                    last = next
+                if stride:
+                    while len(pending) < self.prefetch_pages:
+                        index = _get_start_index(last) + stride
+                        last = _set_start_index(last, index)
+                        submit(last)
+            yield uris
+            if not pending: break
+            uris, next = pending.popleft()[2].get()
+
+    def plan_query(self, klass, **kwargs):
+        """Return the QueryPlan for the list query of the entity class
+        with the filters of its get_* method; the sub-queries into which
+        multi-value filters are split to keep the URL length within
+        MAX_URL_LENGTH. See the module 'planner'.
+        """
+        params = self._get_query_params(getattr(self, 'get_' + klass._URI),
+                                        kwargs)
+        return QueryPlan(self.get_uri(klass._URI), params, self.MAX_URL_LENGTH)
+
+    def _iter_plan(self, plan, tag):
+        """Yield the list of item URIs for each sub-query of the plan,
+        skipping those already given by a previous sub-query.
+        The sub-queries are done concurrently, each paging serially,
+        and the results are given in the order of the plan.
+        """
+        def query(params):
+            result, next = self._get_page(plan.uri, params, tag)
+            while next is not None:     # Serially; this is in the pool.
+                uris, next = self._get_page(next, dict(), tag)
+                result.extend(uris)
+            return result
+        seen = set()
+        for uris in self._get_pool().imap(query, plan.queries):
+            result = []
+            for uri in uris:
+                key = self._get_key(uri)
+                if key in seen: continue
+                seen.add(key)
+                result.append(uri)
+            yield result
+
+    def _get_page(self, uri, params, tag):
+        """GET a page of a list, parsing it incrementally. The query
+        'params' is given only for the first page; the URIs of the
+        following pages already contain it.
+        Return a tuple of the list of URIs of the items having the tag,
+        and the URI of the next page, or None if it is the last page.
+        """
+        if self.response_cache is None:
+            r = self._request('GET', uri, params=params, stream=True)
+            nodes = self.parse_elements(r)
+        else:
+            nodes = self.get(uri, params=params).getchildren()
+        uris = []
+        next = None
+        for node in nodes:
+            if node.tag == tag:
+                uris.append(node.attrib['uri'])
+            elif node.tag == 'next-page':
+                next = node.attrib['uri']
+        return uris, next
+
+    def load(self, instances, force=False):
+        """Get the XML of those instances that do not have it, or of all
+        if 'force' is True. Instances of classes having batch endpoints are
+        retrieved by get_batch, the others by concurrent GETs.
+        Return the instances as a list.
+        """
+        instances = list(instances)
+        batch = []
+        other = []
+        for instance in instances:
+            if not force and instance.root is not None: continue
+            if instance._BATCH:
+                batch.append(instance)
+            else:
+                other.append(instance)
+        if batch:
+            self.get_batch(batch)
+        if len(other) > 1:
+            self._get_pool().map(lambda i: i.get(force=force), other)
+        elif other:
+            other[0].get(force=force)
+        return instances
+
+    def get_batch(self, instances, errors=None):
+        """Get the content of a set of instances using the efficient batch
+        call.
+        The instances are grouped by class and split into chunks of at most
+        'batch_size' instances, and the chunks are retrieved concurrently.
+        The XML is set in the given instances, which are returned in order.
+        A chunk failing with a status in BISECT_STATUSES is bisected, so that
+        one bad instance does not prevent retrieving the others; on other
+        errors the whole chunk fails. Instances of classes without batch
+        endpoints are retrieved by concurrent GETs instead.
+        If 'errors' is a dictionary, each instance that could not be
+        retrieved is put in it, with the exception as value. Otherwise the
+        first such exception is raised after the others have been retrieved.
+        """
+        instances = list(instances)
+        chunks = []
+        groups = dict()
+        seen = set()
+        for instance in instances:
+            if id(instance) in seen: continue
+            seen.add(id(instance))
+            klass = instance.__class__
+            if not klass._BATCH:
+                chunks.append([instance])
+                continue
+            try:
+                chunk = groups[klass._URI]
+            except KeyError:
+                chunk = None
+            if chunk is None or len(chunk) >= self.batch_size:
+                chunk = groups[klass._URI] = []
+                chunks.append(chunk)
+            chunk.append(instance)
+        if len(chunks) > 1:
+            pool = self._get_pool()
+            failures = pool.map(self._get_batch_chunk, chunks)
+        else:
+            failures = [self._get_batch_chunk(chunk) for chunk in chunks]
+        failures = [f for failure in failures for f in failure]
+        if failures and errors is None:
+            raise failures[0][1]
+        result = []
+        for instance, error in failures:
+            errors[instance] = error
+        failed = set([id(instance) for instance, error in failures])
+        seen = set()
+        for instance in instances:
+            if id(instance) in failed or id(instance) in seen: continue
+            seen.add(id(instance))
+            result.append(instance)
         return result
 
-    def get_batch(self, instances):
-        "Get the content of a set of instances using the efficient batch call."
-        if not instances:
-            return []
+    def _get_batch_chunk(self, instances):
+        """Get the content of the instances, all of the same class,
+        in one batch request. Bisect the chunk if the request fails with
+        a status in BISECT_STATUSES; on a failure to connect or other
+        request error, all instances in the chunk fail.
+        Return a list of tuples (instance, exception) for the failures.
+        """
         klass = instances[0].__class__
+        if not klass._BATCH:
+            try:
+                instances[0].get(force=True)
+            except requests.exceptions.RequestException, error:
+                return [(instances[0], error)]
+            return []
         root = ElementTree.Element(nsmap('ri:links'))
         for instance in instances:
             ElementTree.SubElement(root, 'link', dict(uri=instance.uri,
                                                       rel=klass._URI))
         uri = self.get_uri(klass._URI, 'batch/retrieve')
         data = self.tostring(ElementTree.ElementTree(root))
-        root = self.post(uri, data)
+        lookup = dict()
+        for instance in instances:
+            key = self._get_key(instance.uri)
+            lookup[key] = instance
+            lookup.setdefault(key.split('?', 1)[0], instance)
+        try:
+            r = self._request('POST', uri, data=data, stream=True,
+                              idempotent=True, # Retrieve only.
+                              headers={'content-type': 'application/xml'})
+            for node in self.parse_elements(r):
+                key = self._get_key(node.attrib['uri'])
+                try:
+                    instance = lookup[key]
+                except KeyError:
+                    try:
+                        instance = lookup[key.split('?', 1)[0]]
+                    except KeyError:
+                        continue
+                instance.root = node
+        except requests.exceptions.HTTPError, error:
+            if len(instances) == 1 or not self._is_bisectable(error):
+                return [(instance, error) for instance in instances]
+            half = len(instances) / 2
+            return self._get_batch_chunk(instances[:half]) + \
+                   self._get_batch_chunk(instances[half:])
+        except requests.exceptions.RequestException, error:
+            return [(instance, error) for instance in instances]
+        return []
+
+    def _is_bisectable(self, error):
+        """Is the HTTP error one caused by the content of the request, so
+        that splitting a batch may isolate the instance causing it?"""
+        response = getattr(error, 'response', None)
+        return response is not None and \
+               response.status_code in self.BISECT_STATUSES
+
+    def prefetch(self, instances, *paths):
+        """Load the instances, and the entities referenced by them along
+        the attribute paths, such as 'project' or 'artifact.location',
+        level by level, so that accessing these attributes afterwards
+        requires no further requests. Each level is loaded at once,
+        by batch or concurrent GETs; see load.
+        Return the instances as a list.
+        """
+        instances = list(instances)
+        tree = dict()
+        for path in paths:
+            node = tree
+            for name in path.split('.'):
+                node = node.setdefault(name, dict())
+        level = [(instances, tree)]
+        while level:
+            seen = set()
+            pending = []
+            for group, tree in level:
+                for instance in group:
+                    if id(instance) in seen: continue
+                    seen.add(id(instance))
+                    pending.append(instance)
+            self.load(pending)
+            next = []
+            for group, tree in level:
+                for name, subtree in tree.iteritems():
+                    related = []
+                    for instance in group:
+                        getattr(instance.__class__, name) # Check it exists.
+                        try:
+                            value = getattr(instance, name)
+                        except AttributeError:  # No XML element for it.
+                            continue
+                        related.extend(_get_entities(value))
+                    next.append((related, subtree))
+            level = next
+        return instances
+
+    def to_columns(self, instances, fields=(), udfs=()):
+        """Return a dictionary of column name and list of values of the
+        given attributes and UDFs for the instances, which are loaded by
+        batch. See the module 'export' for writing CSV, Parquet or Arrow.
+        """
+        return export.to_columns(self, instances, fields=fields, udfs=udfs)
+
+    def iter_columns(self, instances, fields=(), udfs=(), chunk_size=None):
+        """Yield a dictionary of column name and list of values of the
+        given attributes and UDFs for each chunk of the instances.
+        Memory stays bounded also for a stream such as iter_artifacts,
+        if the cache_policy is 'weak'; otherwise the instances stay cached.
+        """
+        columns = export.ColumnExport(self, fields=fields, udfs=udfs,
+                                      chunk_size=chunk_size)
+        return columns.iter_chunks(instances)
+
+    def get_layouts(self, containers):
+        """Return a list of the Layout of each container, a dense grid of
+        its wells; see the module 'layout'. The containers, their types
+        and the artifacts placed in them are all loaded, level by level,
+        by batch or concurrent requests.
+        """
+        containers = self.load(containers)
+        types = collections.OrderedDict()
+        artifacts = []
+        for container in containers:
+            types[container.type] = True
+            artifacts.extend(container.placements.values())
+        self.load(types.keys() + artifacts)
+        return [Layout(container, container.type, container.placements)
+                for container in containers]
+
+    def download_file(self, file, path, checksum=None, resume=True):
+        """Download the contents of the File instance to the path, streamed
+        in chunks, resuming a partial download; see the module 'transfer'.
+        Raise ValueError if the MD5 digest does not match 'checksum'.
+        Return the MD5 digest as a hex string.
+        """
+        return transfer.download(self, file, path, checksum=checksum,
+                                 resume=resume)
+
+    def upload_file(self, file, path, checksum=None):
+        """Upload the contents of the file at the path to the File instance,
+        streamed in chunks; see the module 'transfer'.
+        Raise ValueError if the MD5 digest does not match 'checksum'.
+        Return the MD5 digest as a hex string.
+        """
+        return transfer.upload(self, file, path, checksum=checksum)
+
+    def transfer_files(self, transfers, upload=False):
+        """Download, or upload, the contents of files concurrently through
+        the pooled session. 'transfers' is a list of tuples (File instance,
+        path) or (File instance, path, checksum).
+        Return a list of tuples (File instance, MD5 digest, exception),
+        where the digest is None for the failed ones, and the exception
+        is None for the successful ones.
+        """
+        if upload:
+            function = self.upload_file
+        else:
+            function = self.download_file
+        def transfer(args):
+            try:
+                return (args[0], function(*args), None)
+            except Exception, error:
+                return (args[0], None, error)
+        transfers = [tuple(t) for t in transfers]
+        if len(transfers) > 1:
+            return self._get_pool().map(transfer, transfers)
+        else:
+            return [transfer(t) for t in transfers]
+
+    def trace_upstream(self, artifacts, stop=()):
+        """Trace the genealogy of the artifacts back towards the submitted
+        samples, breadth-first. Each level is resolved by getting the
+        artifacts of the level by batch, and their parent processes
+        concurrently, so the number of round trips grows with the depth
+        of the graph, not with the number of nodes.
+        stop: Process types (names or Processtype instances) at which the
+              tracing stops; their inputs are not included.
+        Return a dictionary with each artifact reached as key, and a list of
+        tuples (process, input artifact) as value; the list is empty for
+        artifacts without parent process, or where the tracing stopped.
+        """
+        result = collections.OrderedDict()
+        seen = set()
+        frontier = self._new_frontier(artifacts, seen)
+        while frontier:
+            self.load(frontier)
+            processes = collections.OrderedDict()
+            for artifact in frontier:
+                result[artifact] = []
+                if not artifact.get_nodes('parent-process'): continue
+                process = artifact.parent_process
+                processes.setdefault(process, []).append(artifact)
+            self.load(processes.keys())
+            inputs = []
+            for process, outputs in processes.iteritems():
+                if _is_process_type(process, stop): continue
+                ids = dict([(a.id, a) for a in outputs])
+                for input, output in process.input_output_maps:
+                    if not input or not output: continue
+                    try:
+                        artifact = ids[output['uri'].id]
+                    except KeyError:
+                        continue
+                    result[artifact].append((process, input['uri']))
+                    inputs.append(input['uri'])
+            frontier = self._new_frontier(inputs, seen)
+        return result
+
+    def trace_downstream(self, artifacts, stop=()):
+        """Trace the artifacts derived from the given artifacts, breadth-first.
+        The processes that use the artifacts of a level as input are found
+        by queries for chunks of the level's LIMS ids, done concurrently,
+        and are then retrieved concurrently. The number of round trips
+        grows with the depth of the graph, not with the number of nodes.
+        stop: Process types (names or Processtype instances) at which the
+              tracing stops; their outputs are not included.
+        Return a dictionary with each artifact reached as key, and a list
+        of tuples (process, output artifact) as value.
+        """
+        result = collections.OrderedDict()
+        seen = set()
+        frontier = self._new_frontier(artifacts, seen)
+        while frontier:
+            ids = dict()
+            for artifact in frontier:
+                result[artifact] = []
+                ids[artifact.id] = artifact
+            processes = self._get_processes_using(ids.keys())
+            self.load(processes)
+            outputs = []
+            for process in processes:
+                if _is_process_type(process, stop): continue
+                for input, output in process.input_output_maps:
+                    if not input or not output: continue
+                    try:
+                        artifact = ids[input['uri'].id]
+                    except KeyError:
+                        continue
+                    result[artifact].append((process, output['uri']))
+                    outputs.append(output['uri'])
+            frontier = self._new_frontier(outputs, seen)
+        return result
+
+    def _new_frontier(self, artifacts, seen):
+        """Return the list of the artifacts not yet seen, and record them
+        as seen. Artifacts are compared by LIMS id, disregarding the state.
+        """
         result = []
-        for node in root.getchildren():
-            instance = klass(self, uri=node.attrib['uri'])
-            instance.root = node
-            result.append(instance)
+        for artifact in artifacts:
+            if artifact.id in seen: continue
+            seen.add(artifact.id)
+            result.append(artifact)
         return result
 
+    def _get_processes_using(self, limsids):
+        """Return the list of processes having any of the artifacts given
+        by LIMS id as input. A long list of ids is split into sub-queries,
+        done concurrently; see plan_query.
+        """
+        params = self._get_query_params(self.get_processes,
+                                        dict(inputartifactlimsid=limsids))
+        return list(self._iter_instances(Process, params=params))
+
+    def flush(self):
+        """Save all modified instances. Those of classes having batch
+        endpoints are saved in chunks by batch update, the others by PUT,
+        concurrently. A failed chunk is bisected, as in get_batch.
+        The modified instances for the same artifact, with and without
+        state, are saved once; if their XML differs, none of them is saved,
+        and each gets a ValueError, since one would overwrite the other.
+        An instance modified again while being saved remains modified.
+        Return a list of tuples (instance, exception) for the instances,
+        where exception is None for those saved successfully.
+        """
+        with self._dirty_lock:
+            dirty = self._dirty.items()
+        generations = dict(dirty)
+        entities = collections.OrderedDict() # Canonical URI -> instances.
+        for instance, generation in dirty:
+            key = self._get_key(instance.uri).split('?', 1)[0]
+            entities.setdefault(key, []).append(instance)
+        results = []
+        chunks = []
+        groups = dict()
+        for instances in entities.itervalues():
+            error = self._check_conflict(instances)
+            if error is not None:
+                results.extend([(instance, error) for instance in instances])
+                continue
+            klass = instances[0].__class__
+            if not klass._BATCH:
+                chunks.append([instances])
+                continue
+            try:
+                chunk = groups[klass._URI]
+            except KeyError:
+                chunk = None
+            if chunk is None or len(chunk) >= self.batch_size:
+                chunk = groups[klass._URI] = []
+                chunks.append(chunk)
+            chunk.append(instances)
+        if len(chunks) > 1:
+            saved = self._get_pool().map(self._flush_chunk, chunks)
+        else:
+            saved = [self._flush_chunk(chunk) for chunk in chunks]
+        results.extend([r for result in saved for r in result])
+        for instance, error in results:
+            if error is None:
+                self._clear_dirty(instance, generations[instance])
+        return results
+
+    def _check_conflict(self, instances):
+        """Return a ValueError if the modified instances, for the same
+        entity, have different XML, otherwise None. Those sharing the
+        XML agree; the others are compared by their serialized XML.
+        """
+        roots = dict([(id(i.root), i.root) for i in instances]).values()
+        if len(roots) == 1: return None
+        data = set([self.tostring(ElementTree.ElementTree(root))
+                    for root in roots])
+        if len(data) == 1: return None
+        return ValueError("conflicting modifications of %s in %d instances"
+                          % (instances[0].id, len(instances)))
+
+    def _set_dirty(self, instance):
+        """Mark the instance, and those sharing its XML, as modified,
+        with a new generation number."""
+        instances = self._get_sharing(instance)
+        with self._dirty_lock:
+            self._generation += 1
+            for instance in instances:
+                self._dirty[instance] = self._generation
+
+    def _clear_dirty(self, instance, generation=None):
+        """Mark the instance, and those sharing its XML, as not modified;
+        if the generation is given, only if it has not been modified again
+        since that generation."""
+        instances = self._get_sharing(instance)
+        with self._dirty_lock:
+            for instance in instances:
+                if generation is None or \
+                   self._dirty.get(instance) == generation:
+                    self._dirty.pop(instance, None)
+
+    def _flush_chunk(self, entities):
+        """Save the entities, all of the same class, by one batch update,
+        or by PUT if the class has no batch endpoints. Each entity is given
+        as the list of its modified instances, whose XML agrees, and is
+        saved once. Bisect the chunk if the request fails with a status in
+        BISECT_STATUSES.
+        Return a list of tuples (instance, exception or None).
+        """
+        klass = entities[0][0].__class__
+        try:
+            if klass._BATCH:
+                namespace = entities[0][0].root.tag.split('}')[0] + '}'
+                root = ElementTree.Element(namespace + 'details')
+                for instances in entities:
+                    for instance in instances:
+                        self._invalidate(instance.uri)
+                    # A copy; lxml would move the element from the instance.
+                    root.append(copy.deepcopy(instances[0].root))
+                uri = self.get_uri(klass._URI, 'batch/update')
+                self.post(uri, self.tostring(ElementTree.ElementTree(root)))
+            else:
+                for instances in entities:
+                    etree = ElementTree.ElementTree(instances[0].root)
+                    self.put(instances[0].uri, self.tostring(etree))
+        except requests.exceptions.HTTPError, error:
+            if len(entities) == 1 or not self._is_bisectable(error):
+                return [(instance, error)
+                        for instances in entities for instance in instances]
+            half = len(entities) / 2
+            return self._flush_chunk(entities[:half]) + \
+                   self._flush_chunk(entities[half:])
+        return [(instance, None)
+                for instances in entities for instance in instances]
+
     def tostring(self, etree):
         "Return the ElementTree contents as a UTF-8 encoded XML string."
-        outfile = StringIO()
-        self.write(outfile, etree)
-        return outfile.getvalue()
+        return xmlbackend.tostring(etree)
 
     def write(self, outfile, etree):
         "Write the ElementTree contents as UTF-8 encoded XML to the open file."
-        etree.write(outfile, encoding='UTF-8')
+        xmlbackend.write(outfile, etree)
+
+
+# Deprecated names of query arguments, and the current names.
+_RENAMED_PARAMS = dict(inputartifactslimsid='inputartifactlimsid')
+
+def _get_classes(_classes=dict()):
+    "Return the dictionary of entity classes by their URI segment."
+    if not _classes:
+        for klass in Entity.__subclasses__():
+            if klass._URI:
+                _classes[klass._URI] = klass
+    return _classes
+
+def _get_entities(value):
+    """Return the list of the entity instances in the attribute value,
+    which may be a list, tuple or dictionary containing them."""
+    if isinstance(value, Entity):
+        return [value]
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return []
+    result = []
+    for item in value:
+        result.extend(_get_entities(item))
+    return result
+
+def _is_process_type(process, types):
+    """Is the type of the process any of the given names or Processtype
+    instances? Uses the process XML only, without getting the type."""
+    if not types: return False
+    nodes = process.get_nodes('type')
+    if not nodes: return False
+    lims = process.lims
+    for type in types:
+        if isinstance(type, basestring):
+            if nodes[0].text == type: return True
+        elif nodes[0].get('uri') and \
+             lims._get_key(nodes[0].get('uri')) == lims._get_key(type.uri):
+            return True
+    return False
+
+def _canonical_uri(uri):
+    """Return a tuple of the canonical form of the URI, excluding the query,
+    and the value of the 'state' query parameter, or None.
+    """
+    parts = urlparse.urlsplit(uri)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if netloc.endswith(':80') and scheme == 'http':
+        netloc = netloc[:-3]
+    elif netloc.endswith(':443') and scheme == 'https':
+        netloc = netloc[:-4]
+    path = re.sub('/+', '/', parts.path).rstrip('/')
+    state = urlparse.parse_qs(parts.query).get('state', [None])[0]
+    return "%s://%s%s" % (scheme, netloc, path), state
+
+def _get_start_index(uri):
+    "Return the 'start-index' value of the URI query, or None."
+    query = urlparse.parse_qs(urlparse.urlsplit(uri).query)
+    try:
+        return int(query['start-index'][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+
+def _set_start_index(uri, start_index):
+    "Return the URI with the given 'start-index' value in its query."
+    parts = urlparse.urlsplit(uri)
+    query = [(key, value)
+             for key, value in urlparse.parse_qsl(parts.query, True)
+             if key != 'start-index']
+    query.append(('start-index', start_index))
+    return urlparse.urlunsplit(parts._replace(query=urllib.urlencode(query)))
@@ -0,0 +1,161 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Instrumentation of the requests of the LIMS interface.
+
+Each request done by a Lims instance produces an event, a dictionary with
+the items 'method', 'endpoint' (URI template, such as 'samples/{id}'),
+'entity' (the entity class name, if any), 'status' (None on failure to get
+a response), 'error' (the exception, if any), 'latency' (seconds until the
+response was received: the headers of a streamed response, such as a list
+page or a file download, otherwise the whole body), 'bytes_sent',
+'bytes_received' (None if not known, for a streamed response without
+content-length) and 'retries'. The event is given to each listener added
+to the Lims instance by add_listener.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import copy
+import logging
+import threading
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_endpoint(path):
+    """Return the URI template of the path relative to the API base,
+    with the LIMS id replaced by '{id}' and any query removed."""
+    path = path.split('?', 1)[0]
+    if '://' in path:                   # Not below the API base.
+        return path
+    segments = path.split('/')
+    if len(segments) > 1 and segments[1] != 'batch':
+        segments[1] = '{id}'
+    return '/'.join(segments)
+
+
+class Metrics(object):
+    """Listener that aggregates the request events per method and endpoint:
+    counts of requests, errors, statuses and retries, bytes sent and
+    received, and a histogram of the latency.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = dict()
+
+    def __call__(self, event):
+        key = (event['method'], event['endpoint'])
+        with self._lock:
+            try:
+                stats = self.endpoints[key]
+            except KeyError:
+                stats = self.endpoints[key] = dict(
+                    entity=event['entity'],
+                    count=0, errors=0, retries=0, statuses=dict(),
+                    bytes_sent=0, bytes_received=0, latency=0.0,
+                    buckets=[0] * (len(self.buckets) + 1))
+            stats['count'] += 1
+            stats['retries'] += event['retries']
+            status = event['status']
+            if event['error'] is not None or status is None or status >= 400:
+                stats['errors'] += 1
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['bytes_sent'] += event['bytes_sent'] or 0
+            stats['bytes_received'] += event['bytes_received'] or 0
+            latency = event['latency']
+            stats['latency'] += latency
+            for i, bound in enumerate(self.buckets):
+                if latency <= bound:
+                    stats['buckets'][i] += 1
+                    break
+            else:
+                stats['buckets'][-1] += 1
+
+    def get_stats(self):
+        """Return a dictionary with (method, endpoint) as key, and as value
+        a dictionary of the aggregates. The 'buckets' item is the list of
+        counts of latencies up to each of the bounds, non-cumulative, with
+        the count of those above the last bound at the end."""
+        with self._lock:
+            return copy.deepcopy(self.endpoints)
+
+
+class LoggingListener(object):
+    "Listener that logs each request event."
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('genologics')
+        self.level = level
+
+    def __call__(self, event):
+        if not self.logger.isEnabledFor(self.level): return
+        self.logger.log(self.level,
+                        "%s %s %s %.3fs %s bytes%s",
+                        event['method'], event['endpoint'],
+                        event['status'] or type(event['error']).__name__,
+                        event['latency'],
+                        event['bytes_received'],
+                        event['retries'] and
+                        " %d retries" % event['retries'] or '')
+
+
+def to_prometheus(stats, prefix='genologics', buckets=BUCKETS):
+    """Return the statistics given by Lims.stats in the Prometheus
+    text exposition format."""
+    lines = []
+    def metric(name, type, help):
+        lines.append("# HELP %s_%s %s" % (prefix, name, help))
+        lines.append("# TYPE %s_%s %s" % (prefix, name, type))
+    def sample(name, labels, value):
+        labels = ','.join(['%s="%s"' % (k, _escape(v)) for k, v in labels])
+        lines.append("%s_%s{%s} %s" % (prefix, name, labels, value))
+    requests = sorted(stats['requests'].items())
+    metric('requests_total', 'counter',
+           'Requests by method, endpoint, status.')
+    for (method, endpoint), values in requests:
+        for status, count in sorted(values['statuses'].items()):
+            sample('requests_total', [('method', method),
+                                      ('endpoint', endpoint),
+                                      ('status', status or 'error')], count)
+    for name, key, help in [
+        ('request_retries_total', 'retries', 'Retries of requests.'),
+        ('request_sent_bytes_total', 'bytes_sent', 'Bytes of request bodies.'),
+        ('response_bytes_total', 'bytes_received', 'Bytes of responses.')]:
+        metric(name, 'counter', help)
+        for (method, endpoint), values in requests:
+            sample(name, [('method', method), ('endpoint', endpoint)],
+                   values[key])
+    name = 'request_duration_seconds'
+    metric(name, 'histogram',
+           'Time until response headers if streamed, else whole body.')
+    for (method, endpoint), values in requests:
+        labels = [('method', method), ('endpoint', endpoint)]
+        total = 0
+        for bound, count in zip(buckets, values['buckets']):
+            total += count
+            sample(name + '_bucket', labels + [('le', bound)], total)
+        sample(name + '_bucket', labels + [('le', '+Inf')], values['count'])
+        sample(name + '_sum', labels, values['latency'])
+        sample(name + '_count', labels, values['count'])
+    cache = stats['cache']
+    for name, key, help in [('cache_hits_total', 'hits',
+                             'Instance cache hits.'),
+                            ('cache_misses_total', 'misses',
+                             'Instance cache misses.'),
+                            ('cache_evictions_total', 'evictions',
+                             'Instance cache evictions.')]:
+        metric(name, 'counter', help)
+        lines.append("%s_%s %s" % (prefix, name, cache[key]))
+    metric('cache_instances', 'gauge', 'Instances in the cache.')
+    lines.append("%s_cache_instances %s" % (prefix, cache['instances']))
+    return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"')
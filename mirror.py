@@ -0,0 +1,222 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Local mirror of LIMS entities in an SQLite database.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import time
+import sqlite3
+import datetime
+
+from .lims import *
+from .entities import ElementTree
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entity (
+    uri TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    limsid TEXT NOT NULL,
+    name TEXT,
+    project TEXT,
+    container TEXT,
+    xml BLOB NOT NULL,
+    synced REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS entity_name ON entity (type, name);
+CREATE INDEX IF NOT EXISTS entity_limsid ON entity (type, limsid);
+CREATE INDEX IF NOT EXISTS entity_project ON entity (project);
+CREATE INDEX IF NOT EXISTS entity_container ON entity (container);
+CREATE TABLE IF NOT EXISTS udf (
+    uri TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value TEXT);
+CREATE INDEX IF NOT EXISTS udf_uri ON udf (uri);
+CREATE INDEX IF NOT EXISTS udf_value ON udf (name, value);
+CREATE TABLE IF NOT EXISTS sync (
+    type TEXT PRIMARY KEY,
+    high_water TEXT NOT NULL);
+"""
+
+
+class LimsMirror(object):
+    """Local copy of LIMS entities in an SQLite database, for fast queries
+    on name, LIMS id, project, container and UDF values.
+
+    The first sync of an entity class pulls all its instances. Later syncs
+    pull only those modified since the previous sync, using the filter
+    'last_modified' of the get_* methods. The classes without that filter
+    (Sample, Artifact) are pulled in full at every sync.
+    Entities deleted in the LIMS are not removed from the mirror.
+    """
+
+    CLASSES = (Lab, Researcher, Project, Container, Process)
+    INCREMENTAL = (Lab, Researcher, Project, Container, Process)
+
+    def __init__(self, lims, filename, classes=None, margin=60):
+        """lims: The Lims instance to sync from.
+        filename: The SQLite database file; created if it does not exist.
+        classes: The entity classes to mirror; default CLASSES.
+        margin: Seconds of overlap between syncs, to allow for clock skew.
+        """
+        self.lims = lims
+        self.filename = filename
+        self.classes = classes or self.CLASSES
+        self.margin = margin
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def get_high_water(self, klass):
+        """Return the time of the last sync of the entity class,
+        as an ISO format datetime string, or None if never synced."""
+        row = self.db.execute('SELECT high_water FROM sync WHERE type=?',
+                              (klass._URI,)).fetchone()
+        return row and row[0] or None
+
+    def sync(self):
+        """Pull the entities modified since the last sync.
+        Return a dictionary with the number of instances pulled per class.
+        """
+        result = dict()
+        for klass in self.classes:
+            result[klass] = self.sync_class(klass)
+        return result
+
+    def sync_class(self, klass):
+        """Pull the instances of the entity class modified since its
+        last sync. Modified instances not yet saved are skipped, to keep
+        the modifications; if any were, the time of this sync is not
+        recorded, so that the next one pulls them again.
+        Return the number of instances pulled.
+        """
+        start = datetime.datetime.utcnow() - \
+                datetime.timedelta(seconds=self.margin)
+        high_water = start.strftime('%Y-%m-%dT%H:%M:%SZ')
+        query = getattr(self.lims, 'iter_' + klass._URI)
+        if klass in self.INCREMENTAL:
+            instances = query(last_modified=self.get_high_water(klass))
+        else:
+            instances = query()
+        count = 0
+        skipped = 0
+        chunk = []
+        for instance in instances:
+            if instance.is_dirty:
+                skipped += 1
+                continue
+            chunk.append(instance)
+            if len(chunk) >= self.lims.batch_size:
+                count += self._store(chunk)
+                chunk = []
+        count += self._store(chunk)
+        if skipped: return count
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO sync VALUES (?, ?)',
+                            (klass._URI, high_water))
+        return count
+
+    def _store(self, instances):
+        """Get the current XML for the instances, none of them modified,
+        and store them. The XML of those not loaded before is released
+        afterwards. Return the number of instances stored.
+        """
+        if not instances: return 0
+        release = [i for i in instances if i.root is None]
+        self.lims.load(instances, force=True)
+        synced = time.time()
+        with self.db:
+            for instance in instances:
+                uri = instance.uri
+                self.db.execute('INSERT OR REPLACE INTO entity'
+                                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (uri, instance._URI, instance.id,
+                                 _get_name(instance),
+                                 _get_uri(instance, 'project'),
+                                 _get_container_uri(instance),
+                                 sqlite3.Binary(self.lims.tostring(
+                                     ElementTree.ElementTree(instance.root))),
+                                 synced))
+                self.db.execute('DELETE FROM udf WHERE uri=?', (uri,))
+                if not _has_attribute(instance.__class__, 'udf'): continue
+                self.db.executemany('INSERT INTO udf VALUES (?, ?, ?)',
+                                    [(uri, key, _get_value(value))
+                                     for key, value in
+                                     instance.udf.items()])
+        for instance in release:
+            instance.root = None
+        return len(instances)
+
+    def find(self, klass, name=None, limsid=None, project=None,
+             container=None, udf=dict()):
+        """Return the instances of the entity class in the mirror that
+        match all the given criteria. The instances get their XML from
+        the mirror, if not already loaded, without any request to the LIMS.
+        name: Entity name.
+        limsid: LIMS id.
+        project: Project instance or URI.
+        container: Container instance or URI.
+        udf: Dictionary of UDF names and values.
+        """
+        sql = ['SELECT uri, xml FROM entity WHERE type=?']
+        args = [klass._URI]
+        for column, value in [('name', name),
+                              ('limsid', limsid),
+                              ('project', project),
+                              ('container', container)]:
+            if value is None: continue
+            sql.append("%s=?" % column)
+            args.append(getattr(value, 'uri', value))
+        for key, value in udf.iteritems():
+            sql.append('uri IN (SELECT uri FROM udf WHERE name=? AND value=?)')
+            args.extend([key, _get_value(value)])
+        result = []
+        for uri, xml in self.db.execute(' AND '.join(sql), args):
+            instance = klass(self.lims, uri=uri)
+            if instance.root is None:
+                instance.root = ElementTree.fromstring(str(xml))
+            result.append(instance)
+        return result
+
+    def count(self, klass):
+        "Return the number of instances of the entity class in the mirror."
+        return self.db.execute('SELECT COUNT(*) FROM entity WHERE type=?',
+                               (klass._URI,)).fetchone()[0]
+
+
+def _has_attribute(klass, attribute):
+    "Does the class define the attribute, without invoking a descriptor?"
+    for cls in klass.__mro__:
+        if attribute in cls.__dict__: return True
+    return False
+
+def _get_name(instance):
+    try:
+        return instance.name
+    except (AttributeError, KeyError):
+        return None
+
+def _get_uri(instance, attribute):
+    "Return the URI of the entity referenced by the attribute, if any."
+    if not _has_attribute(instance.__class__, attribute): return None
+    try:
+        return getattr(instance, attribute).uri
+    except AttributeError:
+        return None
+
+def _get_container_uri(instance):
+    if isinstance(instance, Artifact):
+        try:
+            return instance.location[0].uri
+        except AttributeError:
+            return None
+    return None
+
+def _get_value(value):
+    "Return the UDF value as stored in the mirror."
+    if value is None: return None
+    if isinstance(value, bool):
+        return value and 'true' or 'false'
+    return unicode(value)
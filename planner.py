@@ -0,0 +1,103 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Splitting of list queries into sub-queries of limited URL length.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import urllib
+
+# Room for the start-index added by the server to the next-page URIs.
+PAGING_LENGTH = len('&start-index=') + 10
+
+
+class QueryPlan(object):
+    """The sub-queries, as params dictionaries, that together give the
+    result of a list query. A multi-value filter that makes the URL too
+    long is split into chunks; since the values of a filter are combined
+    by OR, the union of the results of the sub-queries is that of the
+    original query. If several filters must be split, the sub-queries
+    cover all combinations of their chunks. Room is left for the
+    start-index of the URIs of the following pages. A query that is too
+    long without any multi-value filter to split is kept as it is.
+    """
+
+    def __init__(self, uri, params, max_length):
+        self.uri = uri
+        self.params = params
+        self.max_length = max_length
+        self.queries = _split(uri, params, max_length - PAGING_LENGTH)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def __repr__(self):
+        return "QueryPlan(%s, %d sub-queries, max URL length %d)" % \
+               (self.uri, len(self.queries), max(self.get_lengths()))
+
+    def get_lengths(self):
+        "Return the list of estimated URL lengths of the sub-queries."
+        return [get_length(self.uri, params) for params in self.queries]
+
+
+def get_length(uri, params):
+    "Return the estimated length of the URI with the params as query."
+    query = _encode(params)
+    if query:
+        return len(uri) + 1 + len(query)
+    else:
+        return len(uri)
+
+def _encode(params):
+    items = []
+    for key, value in params.iteritems():
+        if not isinstance(value, (list, tuple)):
+            value = [value]
+        for v in value:
+            if isinstance(v, unicode):
+                v = v.encode('utf-8')
+            items.append((key, v))
+    return urllib.urlencode(items)
+
+def _split(uri, params, max_length):
+    """Return a list of params dictionaries, each giving a URL no longer
+    than the max length, by splitting the longest multi-value filter
+    into chunks, recursively. A query that cannot be split is kept as
+    it is, to be sent as one request.
+    """
+    if get_length(uri, params) <= max_length:
+        return [params]
+    splittable = [(len(_encode({key: value})), key)
+                  for key, value in params.iteritems()
+                  if isinstance(value, (list, tuple)) and len(value) > 1]
+    if not splittable:
+        return [params]
+    key = max(splittable)[1]
+    other = params.copy()
+    values = other.pop(key)
+    available = max_length - get_length(uri, other) - 1
+    chunks = []
+    chunk = []
+    length = 0
+    for value in values:
+        size = len(_encode({key: [value]})) + 1
+        if chunk and length + size > available:
+            chunks.append(chunk)
+            chunk = []
+            length = 0
+        chunk.append(value)
+        length += size
+    chunks.append(chunk)
+    if len(chunks) == 1:                # Does not help; halve instead.
+        half = len(values) / 2
+        chunks = [values[:half], values[half:]]
+    result = []
+    for chunk in chunks:
+        sub = other.copy()
+        sub[key] = chunk
+        result.extend(_split(uri, sub, max_length))
+    return result
@@ -0,0 +1,367 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Local stand-in for a GenoLogics LIMS server, replaying recorded XML.
+
+The stand-in serves the entities it holds at their usual API URIs, the
+lists of them with 'next-page' paging, batch retrieve and update, PUT,
+file contents with Range requests, and file uploads. List queries may be
+filtered by 'name', and processes by 'inputartifactlimsid'; other
+filters are ignored. Latency and errors may be injected, to exercise the
+client as against a busy server.
+
+Entities are recorded from a Lims instance connected to a real server by
+'record', which writes the XML of all loaded instances in its cache to a
+directory, and are replayed by StandinServer.load(directory).
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import os
+import re
+import cgi
+import time
+import random
+import urllib
+import urlparse
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+from xml.etree import ElementTree
+
+from . import xmlbackend
+
+BASEURI = '{BASEURI}'                   # Placeholder in the stored XML.
+VERSION = 'v1'
+
+_EXCEPTION = '<exc:exception xmlns:exc="http://genologics.com/ri/exception">'\
+             '<message>%s</message></exc:exception>'
+_DECLARATION = re.compile(r'^<\?xml[^>]*\?>\s*')
+
+
+def record(lims, directory):
+    """Write the XML of the loaded instances in the cache of the Lims
+    instance to files in the directory, as '<entity URI segment>/<id>.xml',
+    with the base URI of the server replaced by a placeholder. Instances
+    of classes without a URI segment of their own, such as Note, are not
+    written. Return the number of files written.
+    """
+    count = 0
+    for instance in lims.cache.values():
+        if instance.root is None or not instance._URI: continue
+        dirname = os.path.join(directory, instance._URI)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        xml = lims.tostring(xmlbackend.ElementTree.ElementTree(instance.root))
+        xml = xml.replace(lims.baseuri, BASEURI + '/')
+        with open(os.path.join(dirname, instance.id + '.xml'), 'wb') as out:
+            out.write(xml)
+        count += 1
+    return count
+
+
+class StandinServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server standing in for a LIMS server, on localhost.
+    latency: Seconds of delay before each response, or a tuple (min, max)
+             for a uniformly random delay.
+    error_rate: Fraction of requests answered by 'error_status' instead,
+                with a Retry-After header of 0 seconds.
+    page_size: Number of items per page of the lists.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0, error_status=503,
+                 page_size=500, seed=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('localhost', port),
+                                           _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.page_size = page_size
+        self.random = random.Random(seed)
+        self.entities = collections.OrderedDict() # (segment, id) -> XML
+        self.names = dict()                       # (segment, id) -> name
+        self.inputs = dict()              # (segment, id) -> input LIMS ids
+        self.tags = dict()                        # segment -> (ns, tag)
+        self.contents = dict()                    # file id -> bytes
+        self.requests = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def baseuri(self):
+        "The base URI to give to Lims for connecting to this server."
+        return "http://localhost:%d/" % self.server_port
+
+    def start(self):
+        "Serve requests in a background thread. Return the base URI."
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self.baseuri
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def load(self, directory):
+        """Add the entities recorded in the directory by 'record'.
+        Return the number of entities added."""
+        count = 0
+        for segment in sorted(os.listdir(directory)):
+            dirname = os.path.join(directory, segment)
+            if not os.path.isdir(dirname): continue
+            for filename in sorted(os.listdir(dirname)):
+                if not filename.endswith('.xml'): continue
+                with open(os.path.join(dirname, filename), 'rb') as infile:
+                    self.add(segment, filename[:-4], infile.read())
+                count += 1
+        return count
+
+    def add(self, segment, id, xml):
+        """Add or replace the entity given by its URI segment (such as
+        'samples') and LIMS id, with its XML. Occurrences of the base URI
+        of the server in the XML must be given by the placeholder BASEURI.
+        """
+        xml = _DECLARATION.sub('', xml)
+        root = ElementTree.fromstring(xml)
+        namespace, tag = root.tag[1:].split('}')
+        name = root.findtext('name') or root.get('name')
+        inputs = frozenset([node.get('limsid') for node in
+                            root.findall('input-output-map/input')])
+        with self._lock:
+            self.entities[(segment, id)] = xml
+            self.names[(segment, id)] = name
+            self.inputs[(segment, id)] = inputs
+            self.tags.setdefault(segment, (namespace, tag))
+
+    def get_xml(self, segment, id):
+        "Return the XML of the entity, with the actual base URI, or None."
+        xml = self.entities.get((segment, id))
+        if xml is None: return None
+        return xml.replace(BASEURI + '/', self.baseuri)
+
+    def list_ids(self, segment, name=None, inputartifactlimsid=None):
+        """Return the list of the ids of the entities, optionally by name,
+        or by the LIMS id of any input artifact."""
+        if name is not None and not isinstance(name, (list, tuple)):
+            name = [name]
+        inputs = inputartifactlimsid
+        if inputs is not None:
+            if not isinstance(inputs, (list, tuple)):
+                inputs = [inputs]
+            inputs = set(inputs)
+        result = []
+        for key in self.entities.keys():
+            if key[0] != segment: continue
+            if name is not None and self.names.get(key) not in name:
+                continue
+            if inputs is not None and not (inputs & self.inputs[key]):
+                continue
+            result.append(key[1])
+        return result
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    "Request handler of the stand-in server."
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1                       # Write each response in one go.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if not self.begin(): return
+        parts = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(parts.query)
+        segments = self.get_segments(parts.path)
+        if segments is None:
+            if parts.path.rstrip('/') == '/api':
+                return self.send('<ver:versions xmlns:ver='
+                                 '"http://genologics.com/ri/version">'
+                                 '<version major="%s" uri="%sapi/%s"/>'
+                                 '</ver:versions>' %
+                                 (VERSION, self.server.baseuri, VERSION))
+            return self.send_error_xml(404, 'no such resource')
+        if len(segments) == 1:
+            return self.send_list(segments[0], query)
+        if len(segments) == 3 and segments[0] == 'files' and \
+           segments[2] == 'download':
+            return self.send_content(segments[1])
+        xml = self.server.get_xml(segments[0], segments[1])
+        if xml is None:
+            return self.send_error_xml(404, 'no such entity')
+        self.send(xml)
+
+    def do_PUT(self):
+        if not self.begin(): return
+        segments = self.get_segments(urlparse.urlsplit(self.path).path)
+        body = self.read_body()
+        if not segments or len(segments) != 2 or \
+           (segments[0], segments[1]) not in self.server.entities:
+            return self.send_error_xml(404, 'no such entity')
+        self.store(segments[0], segments[1], body)
+        self.send(self.server.get_xml(segments[0], segments[1]))
+
+    def do_POST(self):
+        if not self.begin(): return
+        segments = self.get_segments(urlparse.urlsplit(self.path).path)
+        if segments and len(segments) == 3 and segments[0] == 'files' and \
+           segments[2] == 'upload':
+            return self.receive_content(segments[1])
+        body = self.read_body()
+        if not segments or segments[1:2] != ['batch']:
+            return self.send_error_xml(404, 'no such resource')
+        root = ElementTree.fromstring(body)
+        segment = segments[0]
+        if segments[2:] == ['retrieve']:
+            items = []
+            for node in root:
+                id = node.get('uri').split('?')[0].rstrip('/').split('/')[-1]
+                xml = self.server.get_xml(segment, id)
+                if xml is None:
+                    return self.send_error_xml(400, "no such entity %s" % id)
+                items.append(xml)
+        elif segments[2:] == ['update']:
+            items = []
+            for node in root:
+                id = node.get('uri').split('?')[0].rstrip('/').split('/')[-1]
+                self.store(segment, id, ElementTree.tostring(node))
+                items.append('<link uri="%s" rel="%s"/>' %
+                             (node.get('uri'), segment))
+            return self.send('<ri:links xmlns:ri="http://genologics.com/ri">'
+                             '%s</ri:links>' % ''.join(items))
+        else:
+            return self.send_error_xml(404, 'no such resource')
+        namespace = self.server.tags.get(segment, ('', ''))[0]
+        self.send('<ns:details xmlns:ns="%s">%s</ns:details>' %
+                  (namespace, ''.join(items)))
+
+    def begin(self):
+        """Count the request, apply the latency, and inject an error.
+        Return False if an error was sent."""
+        server = self.server
+        with server._lock:
+            server.requests += 1
+            error = server.error_rate and \
+                    server.random.random() < server.error_rate
+            if error:
+                server.errors += 1
+            latency = server.latency
+            if isinstance(latency, tuple):
+                latency = server.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+        if error:
+            self.read_body()
+            self.send_error_xml(server.error_status, 'injected error',
+                                headers={'retry-after': '0'})
+            return False
+        return True
+
+    def get_segments(self, path):
+        "Return the path segments after the API version, or None."
+        segments = path.strip('/').split('/')
+        if segments[:2] != ['api', VERSION] or len(segments) < 3:
+            return None
+        return segments[2:]
+
+    def read_body(self):
+        length = int(self.headers.get('content-length') or 0)
+        return self.rfile.read(length)
+
+    def store(self, segment, id, xml):
+        self.server.add(segment, id,
+                        xml.replace(self.server.baseuri, BASEURI + '/'))
+
+    def send_list(self, segment, query):
+        server = self.server
+        ids = server.list_ids(segment, query.get('name'),
+                              query.get('inputartifactlimsid'))
+        start = int(query.get('start-index', ['0'])[0])
+        namespace, tag = server.tags.get(segment, ('', segment[:-1]))
+        base = "%sapi/%s/%s" % (server.baseuri, VERSION, segment)
+        items = ['<%s uri="%s/%s" limsid="%s"/>' % (tag, base, id, id)
+                 for id in ids[start:start + server.page_size]]
+        if start + server.page_size < len(ids):
+            query['start-index'] = [str(start + server.page_size)]
+            items.append('<next-page uri="%s?%s"/>' %
+                         (base, _escape(urllib.urlencode(query, True))))
+        self.send('<ns:%s xmlns:ns="%s">%s</ns:%s>' %
+                  (segment, namespace, ''.join(items), segment))
+
+    def send_content(self, id):
+        "Send the file content, or the part given by a Range header."
+        content = self.server.contents.get(id)
+        if content is None:
+            return self.send_error_xml(404, 'no such file')
+        match = re.match(r'bytes=(\d*)-(\d*)$',
+                         self.headers.get('range') or '')
+        if not match:
+            return self.send(content, content_type='application/octet-stream')
+        start, end = match.groups()
+        if start:
+            start = int(start)
+            if end:
+                end = min(int(end), len(content) - 1)
+            else:
+                end = len(content) - 1
+        else:                           # Suffix range; the last bytes.
+            start = max(0, len(content) - int(end or 0))
+            end = len(content) - 1
+        if start >= len(content):
+            return self.send('', status=416, content_type=None,
+                             headers={'content-range':
+                                      'bytes */%d' % len(content)})
+        self.send(content[start:end+1], status=206,
+                  content_type='application/octet-stream',
+                  headers={'content-range': 'bytes %d-%d/%d' %
+                           (start, end, len(content))})
+
+    def receive_content(self, id):
+        "Store the file content given as the multipart form field 'file'."
+        form = cgi.FieldStorage(fp=self.rfile, headers=self.headers,
+                                environ={'REQUEST_METHOD': 'POST'})
+        if ('files', id) not in self.server.entities:
+            return self.send_error_xml(404, 'no such entity')
+        if 'file' not in form or not form['file'].filename:
+            return self.send_error_xml(400, 'no file in the form')
+        self.server.contents[id] = form['file'].value
+        self.send(self.server.get_xml('files', id))
+
+    def send_error_xml(self, status, message, headers=dict()):
+        self.send(_EXCEPTION % message, status=status, headers=headers)
+
+    def send(self, body, status=200, content_type='application/xml',
+             headers=dict()):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        if content_type:
+            self.send_header('content-type', content_type)
+        self.send_header('content-length', str(len(body)))
+        for key, value in headers.iteritems():
+            self.send_header(key, value)
+        if (self.headers.get('connection') or '').lower() == 'close':
+            self.send_header('connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        self.wfile.flush()
+
+
+def _escape(value):
+    return value.replace('&', '&amp;').replace('"', '&quot;')
@@ -0,0 +1,229 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Generator of synthetic LIMS datasets, for tests and benchmarks.
+
+The dataset is a lab with researchers, and projects of samples, each with
+a submitted analyte placed in a plate. The analytes go through a sequence
+of process steps; each step is one process per plate, giving a derived
+analyte placed in a new plate, and a QC result file, for each input.
+Samples, artifacts and projects have UDFs of every type.
+
+The entities are generated as tuples (URI segment, LIMS id, XML), with
+the base URI given by the placeholder of the module 'standin', so that
+they can be added to a StandinServer, or written to a directory for it.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import os
+import random
+import datetime
+from xml.sax.saxutils import escape, quoteattr
+
+from .standin import BASEURI, VERSION
+
+NS = 'http://genologics.com/ri/'
+STEPS = ('Library Prep', 'Library QC', 'Normalization')
+PLATES = {96: (8, 12), 384: (16, 24)}
+QC_FLAGS = ('PASSED', 'PASSED', 'PASSED', 'FAILED', 'UNKNOWN')
+
+
+def count_artifacts(samples, steps=STEPS):
+    "Return the number of artifacts generated for the number of samples."
+    return samples * (1 + 2 * len(steps))
+
+def get_samples(artifacts, steps=STEPS):
+    "Return the number of samples giving about the number of artifacts."
+    return max(1, artifacts / (1 + 2 * len(steps)))
+
+def populate(server, **kwargs):
+    """Add the entities generated by 'generate' with the keyword arguments
+    to the StandinServer. Return the number of entities."""
+    count = 0
+    for segment, id, xml in generate(**kwargs):
+        server.add(segment, id, xml)
+        count += 1
+    return count
+
+def write(directory, **kwargs):
+    """Write the entities generated by 'generate' with the keyword arguments
+    to files in the directory, in the layout read by StandinServer.load.
+    Return the number of entities."""
+    count = 0
+    for segment, id, xml in generate(**kwargs):
+        dirname = os.path.join(directory, segment)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(os.path.join(dirname, id + '.xml'), 'wb') as outfile:
+            outfile.write(xml)
+        count += 1
+    return count
+
+def generate(samples=1000, steps=STEPS, plate_size=96,
+             samples_per_project=500, researchers=5, seed=0):
+    """Yield the entities of a dataset, as tuples (segment, id, xml).
+    samples: Number of samples; see count_artifacts for the artifacts.
+    steps: Names of the process types of the steps for each sample.
+    plate_size: Number of wells in the plates; 96 or 384.
+    samples_per_project: Number of samples in each project.
+    researchers: Number of researchers, the submitters and technicians.
+    seed: For the random UDF values and QC flags.
+    """
+    rng = random.Random(seed)
+    rows, columns = PLATES[plate_size]
+    wells = ["%s:%d" % (chr(ord('A') + row), column + 1)
+             for column in xrange(columns) for row in xrange(rows)]
+    yield 'labs', '1', _entity('lab', 'labs', '1', _tag('name', 'Lab'))
+    for i in xrange(1, researchers + 1):
+        yield 'researchers', str(i), _entity(
+            'researcher', 'researchers', str(i),
+            _tag('first-name', 'First%d' % i) +
+            _tag('last-name', 'Last%d' % i) +
+            _link('lab', 'labs', '1'))
+    yield 'containertypes', '1', _entity(
+        'container-type', 'containertypes', '1',
+        ''.join([_tag('calibrant-well', wells[-1]),
+                 _dimension('x', False, 1, columns),
+                 _dimension('y', True, 0, rows)]),
+        ns='containertype', name="%d well plate" % plate_size)
+    for i, step in enumerate(steps):
+        yield 'processtypes', str(i + 1), _entity(
+            'process-type', 'processtypes', str(i + 1), '',
+            ns='processtype', name=step)
+    for start in xrange(0, samples, samples_per_project):
+        project = 'PRJ%d' % (start / samples_per_project + 1)
+        yield 'projects', project, _entity(
+            'project', 'projects', project,
+            _tag('name', 'Project %s' % project) +
+            _tag('open-date', '2012-01-01') +
+            _link('researcher', 'researchers',
+                  str(rng.randint(1, researchers))) +
+            _udfs(rng, 0))
+    # The samples and their analytes, plate by plate, through the steps.
+    plate = 0
+    for start in xrange(0, samples, plate_size):
+        plate_samples = range(start, min(samples, start + plate_size))
+        analytes = []
+        for i in plate_samples:
+            project = 'PRJ%d' % (i / samples_per_project + 1)
+            sample = 'SMP%d' % i
+            analyte = 'SMP%dPA1' % i
+            researcher = str(rng.randint(1, researchers))
+            yield 'samples', sample, _entity(
+                'sample', 'samples', sample,
+                _tag('name', 'sample_%d' % i) +
+                _tag('date-received', '2012-02-01') +
+                _link('project', 'projects', project) +
+                _link('submitter', 'researchers', researcher) +
+                _link('artifact', 'artifacts', analyte, state=1) +
+                _udfs(rng, i))
+            analytes.append((analyte, sample, None))
+        for step in xrange(len(steps) + 1):
+            container = 'CTR%d_%d' % (plate, step)
+            process = 'PRC%d_%d' % (plate, step)
+            placements = []
+            for well, (analyte, sample, parent) in zip(wells, analytes):
+                yield 'artifacts', analyte, _artifact(
+                    rng, analyte, 'Analyte', sample, parent,
+                    (container, well))
+                placements.append(
+                    '<placement uri="%s/api/%s/artifacts/%s?state=1"'
+                    ' limsid="%s"><value>%s</value></placement>' %
+                    (BASEURI, VERSION, analyte, analyte, well))
+            yield 'containers', container, _entity(
+                'container', 'containers', container,
+                _tag('name', 'plate_%d_%d' % (plate, step)) +
+                _link('type', 'containertypes', '1') +
+                _tag('occupied-wells', str(len(placements))) +
+                ''.join(placements) + _tag('state', 'Populated'))
+            if step == len(steps): break
+            maps = []
+            outputs = []
+            for analyte, sample, parent in analytes:
+                derived = "%sA%d" % (sample, step + 2)
+                result = "%sR%d" % (sample, step + 1)
+                yield 'artifacts', result, _artifact(
+                    rng, result, 'ResultFile', sample, process, None)
+                for output, type in [(derived, 'Analyte'),
+                                     (result, 'ResultFile')]:
+                    maps.append(_map(analyte, parent, output, type))
+                outputs.append((derived, sample, process))
+            yield 'processes', process, _entity(
+                'process', 'processes', process,
+                '<type uri="%s/api/%s/processtypes/%d">%s</type>' %
+                (BASEURI, VERSION, step + 1, escape(steps[step])) +
+                _tag('date-run', '2012-03-%02d' % (step + 1)) +
+                _link('technician', 'researchers',
+                      str(rng.randint(1, researchers))) +
+                ''.join(maps) + _udfs(rng, plate))
+            analytes = outputs
+        plate += 1
+
+
+def _entity(tag, segment, id, content, ns=None, name=None):
+    ns = ns or tag
+    attributes = 'uri="%s/api/%s/%s/%s"' % (BASEURI, VERSION, segment, id)
+    if name is not None:
+        attributes += ' name=%s' % quoteattr(name)
+    elif segment not in ('labs', 'researchers'):
+        attributes += ' limsid="%s"' % id
+    return '<ns:%s xmlns:ns="%s%s" xmlns:udf="%suserdefined" %s>%s</ns:%s>' % \
+           (tag, NS, ns, NS, attributes, content, tag)
+
+def _tag(tag, text):
+    return "<%s>%s</%s>" % (tag, escape(text), tag)
+
+def _link(tag, segment, id, state=None):
+    query = state is not None and '?state=%s' % state or ''
+    return '<%s uri="%s/api/%s/%s/%s%s" limsid="%s"/>' % \
+           (tag, BASEURI, VERSION, segment, id, query, id)
+
+def _dimension(axis, is_alpha, offset, size):
+    return "<%s-dimension><is-alpha>%s</is-alpha><offset>%d</offset>" \
+           "<size>%d</size></%s-dimension>" % \
+           (axis, is_alpha and 'true' or 'false', offset, size, axis)
+
+def _udfs(rng, i):
+    "Return UDF elements of every type, with random values."
+    date = datetime.date(2012, 1, 1) + datetime.timedelta(rng.randint(0, 365))
+    values = [('String', 'Application', rng.choice(['WGS', 'RNA-seq'])),
+              ('Text', 'Comment', "Line one\nline %d" % i),
+              ('Numeric', 'Concentration', "%.2f" % rng.uniform(0.5, 50)),
+              ('Numeric', 'Reads', str(rng.randint(0, 10 ** 8))),
+              ('Boolean', 'Rerun', rng.random() < 0.1 and 'true' or 'false'),
+              ('Date', 'Due', date.isoformat()),
+              ('URI', 'Link', "http://example.org/%d" % i)]
+    return ''.join(['<udf:field type="%s" name="%s">%s</udf:field>' %
+                    (type, name, escape(value))
+                    for type, name, value in values])
+
+def _artifact(rng, id, type, sample, parent, location):
+    content = [_tag('name', id), _tag('type', type), _tag('output-type', type)]
+    if parent:
+        content.append(_link('parent-process', 'processes', parent))
+    content.append(_tag('qc-flag', rng.choice(QC_FLAGS)))
+    if location:
+        content.append('<location>%s%s</location>' %
+                       (_link('container', 'containers', location[0]),
+                        _tag('value', location[1])))
+    content.append(_tag('working-flag', 'true'))
+    content.append(_link('sample', 'samples', sample))
+    content.append(_udfs(rng, 0))
+    return '<ns:artifact xmlns:ns="%sartifact" xmlns:udf="%suserdefined"' \
+           ' uri="%s/api/%s/artifacts/%s?state=1" limsid="%s">%s' \
+           '</ns:artifact>' % (NS, NS, BASEURI, VERSION, id, id,
+                               ''.join(content))
+
+def _map(input, parent, output, type):
+    "Return the input-output-map element."
+    if parent:
+        parent = _link('parent-process', 'processes', parent)
+    else:
+        parent = ''
+    return '<input-output-map><input uri="%s/api/%s/artifacts/%s?state=1"' \
+           ' limsid="%s">%s</input><output uri="%s/api/%s/artifacts/%s' \
+           '?state=1" limsid="%s" output-type="%s"' \
+           ' output-generation-type="PerInput"/></input-output-map>' % \
+           (BASEURI, VERSION, input, input, parent,
+            BASEURI, VERSION, output, output, type)
@@ -0,0 +1,187 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Transfer of the contents of File entities, streamed in chunks.
+
+A download is written to '<path>.part' and renamed to the path when
+complete, so that an interrupted download, whether within the retries of
+one call or in a later call, is resumed by a Range request for the bytes
+not yet received. An upload is sent as a multipart form read from the
+file in chunks; the API has no ranged uploads, so a retry sends it all.
+The MD5 digest of the contents is computed while transferring, and may
+be checked against an expected value.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import os
+import re
+import uuid
+import hashlib
+
+# http://docs.python-requests.org/
+import requests
+
+from .entities import nsmap
+
+CHUNK_SIZE = 1 << 20
+
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)$')
+
+
+def download(lims, file, path, checksum=None, resume=True, retries=3,
+             chunk_size=CHUNK_SIZE):
+    """Download the contents of the File instance to the path. Resume from
+    a partial download, if 'resume' is True. Retry an interrupted transfer
+    up to 'retries' times, continuing from the bytes received.
+    Raise ValueError if the MD5 digest does not match 'checksum'.
+    Return the MD5 digest as a hex string.
+    """
+    partial = path + '.part'
+    if not resume and os.path.exists(partial):
+        os.remove(partial)
+    for attempt in xrange(retries + 1):
+        try:
+            digest = _download(lims, file.uri + '/download', partial,
+                               chunk_size)
+            break
+        except requests.exceptions.HTTPError:
+            raise
+        except IOError:                 # Including those of requests.
+            if attempt == retries: raise
+    if checksum and digest != checksum.lower():
+        os.remove(partial)
+        raise ValueError("MD5 digest %s of %s does not match %s" %
+                         (digest, file.id, checksum))
+    if os.name == 'nt' and os.path.exists(path):
+        os.remove(path)
+    os.rename(partial, path)
+    return digest
+
+def _download(lims, uri, partial, chunk_size):
+    """Get the contents into the partial file, with a Range request for
+    the remainder if it exists. Raise IOError if incomplete.
+    Return the MD5 digest of the whole.
+    """
+    md5 = hashlib.md5()
+    offset = 0
+    if os.path.exists(partial):
+        with open(partial, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(chunk_size), ''):
+                md5.update(chunk)
+                offset += len(chunk)
+    headers = {'accept': '*/*'}
+    if offset:
+        headers['range'] = "bytes=%d-" % offset
+    response = lims._request('GET', uri, headers=headers, stream=True)
+    try:
+        if response.status_code == 416:     # Nothing after the offset.
+            match = re.match(r'bytes \*/(\d+)$',
+                             response.headers.get('content-range', ''))
+            if match and int(match.group(1)) == offset:
+                return md5.hexdigest()
+            os.remove(partial)
+            raise IOError("partial download of %s is not valid" % uri)
+        if response.status_code == 206:
+            match = _CONTENT_RANGE.match(
+                response.headers.get('content-range', ''))
+            if not match or int(match.group(1)) != offset:
+                raise requests.exceptions.HTTPError(
+                    "invalid content-range for %s" % uri)
+            mode = 'ab'
+            expected = int(match.group(2)) + 1
+        elif response.status_code == 200:
+            md5 = hashlib.md5()
+            offset = 0
+            mode = 'wb'
+            expected = response.headers.get('content-length')
+            if expected is not None:
+                expected = int(expected)
+        else:
+            lims.parse_response(response)   # Raises HTTPError.
+            raise requests.exceptions.HTTPError(
+                "%s: %s" % (response.status_code, uri))
+        with open(partial, mode) as outfile:
+            for chunk in response.iter_content(chunk_size):
+                outfile.write(chunk)
+                md5.update(chunk)
+                offset += len(chunk)
+    finally:
+        response.close()
+    if expected is not None and offset != expected:
+        raise IOError("incomplete download of %s: %d of %d bytes" %
+                      (uri, offset, expected))
+    return md5.hexdigest()
+
+def upload(lims, file, path, checksum=None, retries=3,
+           chunk_size=CHUNK_SIZE):
+    """Upload the contents of the file at the path to the File instance,
+    which must exist in the LIMS. Retry a failed transfer up to 'retries'
+    times. Raise ValueError if the MD5 digest of the bytes sent does not
+    match 'checksum'; the file was changed since it was computed.
+    Return the MD5 digest as a hex string.
+    """
+    uri = file.uri + '/upload'
+    for attempt in xrange(retries + 1):
+        body = MultipartFile(path, chunk_size=chunk_size)
+        try:
+            response = lims._request('POST', uri, data=body,
+                                     headers={'content-type':
+                                              body.content_type})
+            break
+        except IOError:                 # Including those of requests.
+            if attempt == retries: raise
+        finally:
+            body.close()
+    lims._invalidate(file.uri)
+    root = lims.parse_response(response)
+    if root.tag == nsmap('file:file'):
+        file.root = root
+    digest = body.md5.hexdigest()
+    if checksum and digest != checksum.lower():
+        raise ValueError("MD5 digest %s of %s does not match %s" %
+                         (digest, path, checksum))
+    return digest
+
+
+class MultipartFile(object):
+    """Read-only file-like object giving a multipart/form-data body with
+    the contents of the file at the path as the field 'name', read in
+    chunks. The MD5 digest of the contents is computed as it is read.
+    """
+
+    def __init__(self, path, name='file', chunk_size=CHUNK_SIZE):
+        boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary=%s" % boundary
+        filename = os.path.basename(path).replace('"', '')
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        self._head = "--%s\r\nContent-Disposition: form-data; name=\"%s\";" \
+                     " filename=\"%s\"\r\nContent-Type:" \
+                     " application/octet-stream\r\n\r\n" % \
+                     (boundary, name, filename)
+        self._tail = "\r\n--%s--\r\n" % boundary
+        self._file = open(path, 'rb')
+        self._size = os.path.getsize(path)
+        self.chunk_size = chunk_size
+        self.md5 = hashlib.md5()
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def read(self, size=-1):
+        "Return the next part of the body; at most one chunk of the file."
+        if size is None or size < 0:
+            size = self.chunk_size
+        if self._head:
+            result, self._head = self._head[:size], self._head[size:]
+            return result
+        chunk = self._file.read(min(size, self.chunk_size))
+        if chunk:
+            self.md5.update(chunk)
+            return chunk
+        result, self._tail = self._tail[:size], self._tail[size:]
+        return result
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,203 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+Retries, rate limiting and adaptive concurrency for the LIMS interface.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import time
+import random
+import threading
+import email.utils
+
+import requests
+
+
+class TransportPolicy(object):
+    """Policy for sending the requests of a Lims instance:
+
+    Retries: A request of an idempotent method that fails to connect, times
+    out, or gets a status in 'retry_statuses', is retried up to 'retries'
+    times, after a random delay of up to 'backoff' * 2 ** attempt seconds
+    ('full jitter'), at most 'max_backoff'. A Retry-After header in the
+    response gives the delay instead.
+
+    Rate limit: If 'rate' is given, at most 'rate' requests per second are
+    started on average, with bursts of up to 'burst' requests.
+
+    Adaptive concurrency: If 'max_concurrency' is given, the number of
+    requests in progress is limited. The limit grows additively while
+    requests succeed within 'latency_target' seconds (if given), and is
+    halved when a request fails: a connection error or time-out, a server
+    error status (5xx), or a status in 'retry_statuses' or
+    THROTTLE_STATUSES, such as 429 (AIMD).
+    """
+
+    RETRY_STATUSES = (429, 502, 503, 504)
+    THROTTLE_STATUSES = (429, 503)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0,
+                 retry_statuses=RETRY_STATUSES, rate=None, burst=None,
+                 max_concurrency=None, min_concurrency=1,
+                 latency_target=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        if rate:
+            self.bucket = TokenBucket(rate, burst or max(1, int(rate)))
+        else:
+            self.bucket = None
+        if max_concurrency:
+            self.limit = AdaptiveLimit(min_concurrency, max_concurrency,
+                                       latency_target=latency_target)
+        else:
+            self.limit = None
+        self.retried = 0
+
+    def send(self, request, method, uri, idempotent=None, info=None,
+             **kwargs):
+        """Send the request by calling the function 'request' with the
+        method, URI and keyword arguments, according to the policy.
+        'idempotent' tells whether the request may be retried; by default
+        it is for the methods in IDEMPOTENT_METHODS. If 'info' is given,
+        its item 'retries' is set to the number of retries.
+        Return the response, or raise the exception of the last attempt.
+        """
+        if idempotent is None:
+            idempotent = method.upper() in self.IDEMPOTENT_METHODS
+        attempt = 0
+        while True:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            if self.limit is not None:
+                self.limit.acquire()
+            started = time.time()
+            response = None
+            try:
+                response = request(method, uri, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout):
+                if self.limit is not None:
+                    self.limit.release(time.time() - started, False)
+                if not idempotent or attempt >= self.retries: raise
+            except Exception:           # Not retried, but a failure.
+                if self.limit is not None:
+                    self.limit.release(time.time() - started, False)
+                raise
+            else:
+                status = response.status_code
+                if self.limit is not None:
+                    ok = status < 500 and \
+                         status not in self.THROTTLE_STATUSES and \
+                         status not in self.retry_statuses
+                    self.limit.release(time.time() - started, ok)
+                if not idempotent or attempt >= self.retries or \
+                   status not in self.retry_statuses:
+                    return response
+            delay = self.get_delay(attempt, response)
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+            self.retried += 1
+            if info is not None:
+                info['retries'] = attempt
+
+    def get_delay(self, attempt, response=None):
+        """Return the seconds to wait before the next attempt; given by the
+        Retry-After header of the response, if any, else jittered backoff."""
+        if response is not None:
+            delay = get_retry_after(response)
+            if delay is not None:
+                return min(delay, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+
+def get_retry_after(response):
+    """Return the seconds given by the Retry-After header of the response,
+    as a number or an HTTP date, or None."""
+    value = response.headers.get('retry-after')
+    if not value: return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    date = email.utils.parsedate_tz(value)
+    if date is None: return None
+    return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+class TokenBucket(object):
+    "Rate limit of 'rate' acquisitions per second, with bursts of 'burst'."
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        "Wait until a token is available, and take it."
+        while True:
+            with self._lock:
+                now = time.time()
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.updated)*self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimit(object):
+    """Limit of the number of acquisitions in progress. Like TCP congestion
+    control, it starts with 'minimum' and increases by one for each
+    successful release until the first failure ('slow start'); thereafter
+    by about one for each 'limit' successful releases (i.e. by one per
+    round trip when all are in progress). It is halved on failure, at most
+    once per round trip.
+    """
+
+    def __init__(self, minimum, maximum, latency_target=None):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.limit = float(minimum)
+        self.in_progress = 0
+        self._decreased = 0.0
+        self._slow_start = True
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        "Wait until below the limit, and count one more in progress."
+        with self._condition:
+            while self.in_progress >= int(self.limit):
+                self._condition.wait()
+            self.in_progress += 1
+
+    def release(self, latency, ok):
+        """Count one less in progress, and adjust the limit according to
+        the latency in seconds and the success of the request."""
+        with self._condition:
+            self.in_progress -= 1
+            if ok and (self.latency_target is None or
+                       latency <= self.latency_target):
+                if self._slow_start:
+                    increase = 1.0
+                else:
+                    increase = 1.0 / self.limit
+                self.limit = min(self.maximum, self.limit + increase)
+            else:
+                self._slow_start = False
+                now = time.time()
+                if now - self._decreased > latency:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self._decreased = now
+            self._condition.notify_all()
@@ -0,0 +1,84 @@
+"""Python interface to GenoLogics LIMS via its REST API.
+
+XML backend for the LIMS interface.
+
+The module attribute ElementTree is lxml.etree if lxml is installed,
+otherwise the standard library cElementTree, or ElementTree as a last
+resort. Only the API common to these is used in the other modules.
+
+Per Kraulis, Science for Life Laboratory, Stockholm, Sweden.
+Copyright (C) 2012 Per Kraulis
+"""
+
+import operator
+from cStringIO import StringIO
+
+try:
+    from lxml import etree as ElementTree
+    BACKEND = 'lxml'
+except ImportError:
+    try:
+        from xml.etree import cElementTree as ElementTree
+        BACKEND = 'cElementTree'
+    except ImportError:
+        from xml.etree import ElementTree
+        BACKEND = 'ElementTree'
+
+
+def register_namespace(prefix, uri):
+    """Register the prefix to use for the namespace URI when serializing.
+    lxml uses the prefixes of the parsed XML instead.
+    """
+    if BACKEND == 'lxml': return
+    from xml.etree import ElementTree as PyElementTree
+    PyElementTree.register_namespace(prefix, uri)
+
+def compile_find(tag):
+    """Return a function that returns the first child element of a node
+    having the tag, or None. Compiled to XPath for lxml.
+    """
+    if BACKEND == 'lxml':
+        xpath = _compile_xpath(tag)
+        def find(node):
+            result = xpath(node)
+            if result:
+                return result[0]
+            else:
+                return None
+        return find
+    else:
+        return operator.methodcaller('find', tag)
+
+def compile_findall(tag):
+    """Return a function that returns the list of child elements of a node
+    having the tag. Compiled to XPath for lxml.
+    """
+    if BACKEND == 'lxml':
+        return _compile_xpath(tag)
+    else:
+        return operator.methodcaller('findall', tag)
+
+def _compile_xpath(tag):
+    "Convert the ElementTree '{namespace}name' tag to a compiled XPath."
+    if tag.startswith('{'):
+        uri, name = tag[1:].split('}')
+        return ElementTree.XPath('ns:' + name, namespaces=dict(ns=uri))
+    else:
+        return ElementTree.XPath(tag)
+
+def tostring(etree):
+    "Return the ElementTree contents as a UTF-8 encoded XML string."
+    if BACKEND == 'lxml':
+        return ElementTree.tostring(etree, encoding='UTF-8',
+                                    xml_declaration=True)
+    else:
+        outfile = StringIO()
+        etree.write(outfile, encoding='UTF-8')
+        return outfile.getvalue()
+
+def write(outfile, etree):
+    "Write the ElementTree contents as UTF-8 encoded XML to the open file."
+    if BACKEND == 'lxml':
+        etree.write(outfile, encoding='UTF-8', xml_declaration=True)
+    else:
+        etree.write(outfile, encoding='UTF-8')